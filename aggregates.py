@@ -0,0 +1,382 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+from exclusions import ExclusionStats, exclusion_summary, insufficient_data_reason
+from data_cache import file_hash
+from data_store import load_shared_data
+from survey_weights import ReplicateWeights, metric_values
+from features import dashboard_column
+
+
+def _python_value(value):
+    '''
+    Converts numpy scalars/missing values to plain python so the cube can be saved as json.
+    '''
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def _category_order(values):
+    '''
+    {category: position on the chart axis}: the dtype's order for categorical variables,
+    otherwise sorted by value.
+    '''
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return {category: i for i, category in enumerate(values.cat.categories)}
+    return {category: i for i, category in enumerate(sorted(values.dropna().unique()))}
+
+
+cube_columns = ["variable", "category", "excluded", "order", "count", "yes_count",
+                "score_count", "score_sum", "weighted_rate", "weighted_rate_se",
+                "weighted_score", "weighted_score_se"]
+
+
+def build_aggregate_cube(df, variables=None):
+    '''
+    Precomputes everything the dashboard charts and exclusion text need, for every
+    variable and category:
+        - count: number of respondents
+        - yes_count: how many volunteered in the past year
+        - score_count / score_sum: respondents with an engagement score, and the sum of scores
+        - excluded: whether the category is a nonresponse (exclude_categories)
+        - order: sort position of the category on the chart axis
+        - weighted_rate / weighted_score (and their _se): survey-weighted volunteer rate (%)
+          and mean engagement score with replicate standard errors, if df has the weights
+
+    Rows with no value for the variable are kept with category None, so the counts for a
+    variable always add up to the number of respondents.
+    '''
+    is_yes = (df['Volunteered_Past_Year'] == "Yes").to_numpy(dtype=float)
+    score = pd.to_numeric(df['political_engagement_score'], errors='coerce').to_numpy(dtype=float)
+    has_score = ~np.isnan(score)
+    score = np.where(has_score, score, 0)
+
+    exclusions = ExclusionStats(df, config.exclude_categories)
+    weights = ReplicateWeights(df) if config.weight_column in df.columns else None
+    metrics = {"volunteer": metric_values(df, "volunteer"),
+               "engagement": metric_values(df, "engagement")}
+
+    rows = []
+    for column in variables or config.variable_mapping:
+        values = dashboard_column(df, column)
+        reasons = exclusions.reasons(column)
+        excluded = exclusions.variable_mask(column)
+
+        # Excluded respondents are grouped under their nonresponse label
+        labels = values.astype(object).where(~excluded, reasons.astype(object))
+        codes, uniques = pd.factorize(labels)
+        # factorize gives missing values -1; give them their own slot at the end
+        codes = np.where(codes < 0, len(uniques), codes)
+        n_groups = len(uniques) + 1
+
+        count = np.bincount(codes, minlength=n_groups)
+        yes_count = np.bincount(codes, weights=is_yes, minlength=n_groups)
+        score_count = np.bincount(codes, weights=has_score, minlength=n_groups)
+        score_sum = np.bincount(codes, weights=score, minlength=n_groups)
+        is_excluded = np.zeros(n_groups, dtype=bool)
+        np.logical_or.at(is_excluded, codes, excluded)
+
+        weighted = {}
+        for name, metric, scale in [("rate", "volunteer", 100), ("score", "engagement", 1)]:
+            if weights is None:
+                estimate = standard_error = np.full(n_groups, np.nan)
+            else:
+                estimate, standard_error = weights.ratio(codes, n_groups, *metrics[metric])
+            weighted[f"weighted_{name}"] = estimate * scale
+            weighted[f"weighted_{name}_se"] = standard_error * scale
+
+        order = _category_order(values)
+
+        for i, category in enumerate(list(uniques) + [None]):
+            if count[i] == 0:
+                continue
+            rows.append({
+                "variable": column,
+                "category": _python_value(category),
+                "excluded": bool(is_excluded[i]),
+                "order": order.get(category, len(order)),
+                "count": int(count[i]),
+                "yes_count": int(yes_count[i]),
+                "score_count": int(score_count[i]),
+                "score_sum": float(score_sum[i]),
+                **{name: _python_value(estimates[i]) for name, estimates in weighted.items()},
+            })
+
+    return pd.DataFrame(rows, columns=cube_columns)
+
+
+pair_columns = ["row_variable", "row_category", "row_order", "column_variable",
+                "column_category", "column_order", "count", "yes_count", "score_count",
+                "score_sum"]
+
+
+def build_pair_index(df, variables=None, exclude=None):
+    '''
+    The two-way version of the cube, for drilling down by two variables at once (e.g.
+    Education_Level x Urban_Rural_Status): for every pair of variables and every pair of
+    their categories, the number of respondents, how many volunteered and the engagement
+    score count/sum. Like the chart data, respondents excluded for either variable are left
+    out, and only cells with respondents are kept, so all 55 pairs of the dashboard
+    variables come to a few thousand rows.
+
+    Each pair is stored once, in the order of variables (see pair_metric).
+    '''
+    variables = list(variables or config.variable_mapping)
+    is_yes = (df['Volunteered_Past_Year'] == "Yes").to_numpy(dtype=float)
+    score = pd.to_numeric(df['political_engagement_score'], errors='coerce').to_numpy(dtype=float)
+    has_score = ~np.isnan(score)
+    score = np.where(has_score, score, 0)
+
+    exclusions = ExclusionStats(df, exclude)
+    coded = {}
+    for column in variables:
+        values = dashboard_column(df, column)
+        included = values.notna().to_numpy() & ~exclusions.variable_mask(column)
+        # Excluded and missing rows get code -1
+        codes, categories = pd.factorize(values.where(included))
+        order = _category_order(values)
+        categories = np.array([_python_value(category) for category in categories], dtype=object)
+        coded[column] = (codes, categories,
+                         np.array([order.get(category, len(order)) for category in categories],
+                                  dtype=int))
+
+    frames = []
+    for i, row_variable in enumerate(variables):
+        row_codes, row_categories, row_order = coded[row_variable]
+        for column_variable in variables[i + 1:]:
+            column_codes, column_categories, column_order = coded[column_variable]
+            n_columns = len(column_categories)
+            n_cells = len(row_categories) * n_columns
+
+            keep = (row_codes >= 0) & (column_codes >= 0)
+            cells = row_codes[keep] * n_columns + column_codes[keep]
+            count = np.bincount(cells, minlength=n_cells)
+            filled = np.flatnonzero(count)
+            rows, columns = filled // n_columns, filled % n_columns
+
+            frames.append(pd.DataFrame({
+                "row_variable": row_variable,
+                "row_category": row_categories[rows],
+                "row_order": row_order[rows],
+                "column_variable": column_variable,
+                "column_category": column_categories[columns],
+                "column_order": column_order[columns],
+                "count": count[filled],
+                "yes_count": np.bincount(cells, weights=is_yes[keep],
+                                         minlength=n_cells)[filled].astype(int),
+                "score_count": np.bincount(cells, weights=has_score[keep],
+                                           minlength=n_cells)[filled].astype(int),
+                "score_sum": np.bincount(cells, weights=score[keep], minlength=n_cells)[filled],
+            }))
+
+    if not frames:
+        return pd.DataFrame(columns=pair_columns)
+    return pd.concat(frames, ignore_index=True)[pair_columns]
+
+
+def pair_metric(index, row_column, column_column, metric_type):
+    '''
+    Heatmap data for two variables from the pair index: one row per (row_category,
+    column_category) cell with respondents, in axis order, with the number of respondents
+    (count) and the volunteer rate (%) or mean engagement score as Metric_Value. Either
+    order of the two variables works.
+    '''
+    if row_column == column_column:
+        raise ValueError("pair_metric needs two different variables")
+
+    rows = index[(index["row_variable"] == row_column) & (index["column_variable"] == column_column)]
+    if rows.empty:
+        # Stored the other way round
+        rows = index[(index["row_variable"] == column_column)
+                     & (index["column_variable"] == row_column)].rename(columns={
+            "row_category": "column_category", "row_order": "column_order",
+            "column_category": "row_category", "column_order": "row_order"})
+    rows = rows.sort_values(["row_order", "column_order"])
+
+    if metric_type == "volunteer":
+        metric_value = rows["yes_count"] / rows["count"] * 100
+    else:
+        metric_value = rows["score_sum"] / rows["score_count"].replace(0, np.nan)
+
+    return pd.DataFrame({"row_category": rows["row_category"].to_numpy(),
+                         "column_category": rows["column_category"].to_numpy(),
+                         "count": rows["count"].to_numpy(),
+                         "Metric_Value": metric_value.to_numpy()})
+
+
+def cube_path(csv_path):
+    return Path(csv_path).with_suffix(".cube.json")
+
+
+def pairs_path(csv_path):
+    return Path(csv_path).with_suffix(".pairs.json")
+
+
+def write_aggregate_cube(df, csv_path, source_hash=None):
+    '''
+    Offline step: builds the cube from the cleaned data and saves it next to the csv, tagged
+    with the csv's hash (source_hash, if the caller already has it) so the app can tell when
+    it's stale.
+    '''
+    cube = build_aggregate_cube(df)
+    with open(cube_path(csv_path), "w") as f:
+        json.dump({"source_sha256": source_hash or file_hash(csv_path),
+                   "rows": cube.to_dict(orient="records")}, f)
+    return cube
+
+
+def weight_columns(csv_path):
+    '''
+    The survey weight columns in the csv (none for data cleaned before they were selected).
+    '''
+    header = pd.read_csv(csv_path, nrows=0).columns
+    return [column for column in [config.weight_column] + config.replicate_weight_columns
+            if column in header]
+
+
+def write_pair_index(df, csv_path, source_hash=None):
+    '''
+    Offline step: builds the pair index and saves it next to the csv, like the cube. It's
+    saved as columns + rows of values rather than records, which keeps the file small.
+    '''
+    index = build_pair_index(df)
+    with open(pairs_path(csv_path), "w") as f:
+        json.dump({"source_sha256": source_hash or file_hash(csv_path),
+                   **index.to_dict(orient="split", index=False)}, f)
+    return index
+
+
+def _dashboard_data(csv_path, source_hash):
+    return load_shared_data(csv_path, columns=list(config.variable_mapping) +
+                            ["Volunteered_Past_Year", "political_engagement_score"] +
+                            weight_columns(csv_path), source_hash=source_hash)
+
+
+def load_aggregate_cube(csv_path, source_hash=None):
+    '''
+    Loads the cube saved next to csv_path. If it's missing or was built from a different
+    version of the csv, it's rebuilt from the shared data store (and saved again if possible).
+    source_hash is the csv's file_hash, if the caller already has it (hashing a big csv
+    takes a while, so the app hashes it once at startup).
+    '''
+    path = cube_path(csv_path)
+    source_hash = source_hash or file_hash(csv_path)
+    if path.exists():
+        with open(path) as f:
+            saved = json.load(f)
+        # Cubes saved before a column was added get rebuilt too
+        if (saved.get("source_sha256") == source_hash
+                and all(set(cube_columns) <= set(row) for row in saved["rows"][:1])):
+            return pd.DataFrame(saved["rows"], columns=cube_columns)
+
+    df = _dashboard_data(csv_path, source_hash)
+    try:
+        return write_aggregate_cube(df, csv_path, source_hash)
+    except OSError as e:
+        print(f"Could not write aggregate cube for {csv_path}: {e}")
+        return build_aggregate_cube(df)
+
+
+def load_pair_index(csv_path, source_hash=None):
+    '''
+    Loads the pair index saved next to csv_path, rebuilding it the same way as
+    load_aggregate_cube when it's missing or stale.
+    '''
+    path = pairs_path(csv_path)
+    source_hash = source_hash or file_hash(csv_path)
+    if path.exists():
+        with open(path) as f:
+            saved = json.load(f)
+        if saved.get("source_sha256") == source_hash:
+            return pd.DataFrame(saved["data"], columns=saved["columns"])
+
+    df = _dashboard_data(csv_path, source_hash)
+    try:
+        return write_pair_index(df, csv_path, source_hash)
+    except OSError as e:
+        print(f"Could not write pair index for {csv_path}: {e}")
+        return build_pair_index(df)
+
+
+def cube_metric(cube, column, metric_type, weighted=False):
+    '''
+    Chart data for one variable: one row per (non-excluded) category, in axis order, with
+    the volunteer rate (%) or the mean engagement score as Metric_Value.
+
+    With weighted=True, Metric_Value is the survey-weighted estimate instead, and Lower/Upper
+    give its 95% interval from the replicate weights.
+    '''
+    rows = cube[(cube["variable"] == column) & ~cube["excluded"] & cube["category"].notna()]
+    rows = rows.sort_values("order")
+
+    if weighted:
+        name = "weighted_rate" if metric_type == "volunteer" else "weighted_score"
+        metric_value = rows[name].astype(float)
+        margin = 1.96 * rows[f"{name}_se"].astype(float)
+        return pd.DataFrame({"category": rows["category"].to_numpy(),
+                             "Metric_Value": metric_value.to_numpy(),
+                             "Lower": (metric_value - margin).to_numpy(),
+                             "Upper": (metric_value + margin).to_numpy()})
+
+    if metric_type == "volunteer":
+        metric_value = rows["yes_count"] / rows["count"] * 100
+    else:
+        metric_value = rows["score_sum"] / rows["score_count"].replace(0, np.nan)
+
+    return pd.DataFrame({"category": rows["category"].to_numpy(),
+                         "Metric_Value": metric_value.to_numpy()})
+
+
+def cube_exclusion_stats(cube, column, metric_type=None):
+    '''
+    exclusion_summary for a variable, read from the cube (see exclusions.py). For the
+    engagement score, respondents without a score are also excluded.
+    '''
+    rows = cube[cube["variable"] == column]
+    excluded = rows[rows["excluded"]]
+    # Several years' cubes stacked together have a row per reason for each year
+    by_reason = excluded.groupby("category", observed=True, sort=False)["count"].sum().to_dict()
+
+    if metric_type == "engagement":
+        included = rows[~rows["excluded"]]
+        by_reason[insufficient_data_reason] = (included["count"] - included["score_count"]).sum()
+
+    return exclusion_summary(rows["count"].sum(), by_reason)
+
+
+def weighted_estimates(df, column, metric_type="volunteer", exclude=None, weights=None):
+    '''
+    Survey-weighted volunteer rate (%) or mean engagement score for each value of column
+    (a variable_mapping column, or any other grouping column like "US State"), leaving out
+    the nonresponse categories in exclude.
+
+    Returns one row per category with the Estimate, its replicate-weight SE, a 95% interval
+    (Lower/Upper) and the unweighted number of Respondents. Pass weights (a ReplicateWeights
+    built from df) to reuse the weight matrix across calls.
+    '''
+    weights = weights if weights is not None else ReplicateWeights(df)
+    values = dashboard_column(df, column)
+    keep = values.notna() & ~values.isin(
+        config.exclude_categories if exclude is None else exclude)
+
+    codes, categories = pd.factorize(values.where(keep), sort=True)
+    # Excluded rows go into an extra group at the end, which is dropped below
+    codes = np.where(codes < 0, len(categories), codes)
+    estimates, standard_errors = weights.ratio(codes, len(categories) + 1,
+                                               *metric_values(df, metric_type))
+
+    scale = 100 if metric_type == "volunteer" else 1
+    result = pd.DataFrame({
+        column: categories,
+        "Estimate": estimates[:-1] * scale,
+        "SE": standard_errors[:-1] * scale,
+        "Respondents": np.bincount(codes, minlength=len(categories) + 1)[:-1],
+    })
+    result["Lower"] = result["Estimate"] - 1.96 * result["SE"]
+    result["Upper"] = result["Estimate"] + 1.96 * result["SE"]
+    return result
@@ -0,0 +1,225 @@
+'''
+Benchmarks for the cleaning and dashboard code on synthetic CEV/ANES-shaped data, so they
+run offline without the real extracts.
+
+    python benchmark.py                         # 10k, 100k and 1M rows
+    python benchmark.py --sizes 10000 10000000  # any sizes
+    python benchmark.py --weights               # include the 161 survey weight columns
+
+Each run appends one json line per (stage, rows) to data/benchmarks.jsonl (see --output),
+tagged with the run time, git commit and library versions, so runs can be compared later.
+'''
+import argparse
+import json
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+from decoder import CodeTableDecoder
+from schema import apply_schema, is_code
+from exclusions import ExclusionStats
+from aggregates import (build_aggregate_cube, cube_metric, cube_exclusion_stats,
+                        build_pair_index, pair_metric)
+from features import add_derived_columns
+from polarization import apply_crosswalks, polar_table, polar_table_by_party, SpreadStats
+from instrumentation import memory_usage
+
+
+# State FIPS codes (with gaps, like the real ones); the benchmark labels them itself so it
+# doesn't need the us package
+state_fips = [f for f in range(1, 57) if f not in {3, 7, 14, 43, 52}]
+fips_labels = {fips: f"S{fips:02d}" for fips in state_fips}
+
+
+def raw_values(table, qualitative_share):
+    '''
+    The raw values a variable can take, from its code table, and their sampling
+    probabilities: the numeric/dot codes get 1 - qualitative_share between them, and the
+    qualitative entries that enhance_mapping_dictionary adds ('Yes', 'YES', 'yes', ...) share
+    the rest, so the generated data mixes both like the real files do.
+    '''
+    codes = [key for key in table if is_code(key) or str(key).startswith(".")]
+    labels = [key for key in table if key is not None and key not in codes]
+
+    if not labels:
+        return codes, np.full(len(codes), 1 / len(codes))
+    probabilities = ([(1 - qualitative_share) / len(codes)] * len(codes)
+                     + [qualitative_share / len(labels)] * len(labels))
+    return codes + labels, np.array(probabilities)
+
+
+def synthetic_cev(n_rows, seed=0, qualitative_share=0.1, missing_share=0.02, weights=False):
+    '''
+    A raw CEV-shaped frame (raw variable names, string values) with n_rows respondents.
+    Every selected variable with a code table is sampled from that table's codes and labels;
+    missing_share of each column is left empty. weights adds pwsrwgt and its replicates.
+    '''
+    rng = np.random.default_rng(seed)
+    columns = {}
+
+    for key in config.merge_keys:
+        columns[key] = rng.integers(1, 10 ** 9, n_rows)
+
+    for variable in dict.fromkeys(config.selected_variables):
+        table = getattr(config, f"{variable}_dict", None)
+        if table is None:
+            continue
+        values, probabilities = raw_values(table, qualitative_share)
+        column = rng.choice(np.array(values, dtype=object), n_rows, p=probabilities)
+        column[rng.random(n_rows) < missing_share] = None
+        columns[variable] = column
+
+    columns["gestfips"] = rng.choice(state_fips, n_rows).astype(str)
+
+    if weights:
+        person_weight = rng.uniform(500, 5000, n_rows)
+        columns[config.weight_variables[0]] = person_weight
+        for variable in config.weight_variables[1:]:
+            columns[variable] = person_weight * rng.uniform(0.5, 1.5, n_rows)
+
+    return pd.DataFrame(columns)
+
+
+def synthetic_anes(n_rows, seed=0):
+    '''
+    A raw ANES-shaped frame: the four questions the crosswalks cover (including codes they
+    don't, like -7) and a state.
+    '''
+    rng = np.random.default_rng(seed)
+    ideology_codes = list(config.anes_ideology_labels) + [99, -7]
+    return pd.DataFrame({
+        "V201200": rng.choice(ideology_codes, n_rows),
+        "V201228": rng.choice(list(config.anes_crosswalks["V201228"][
+            "Party_Affiliation_(V201228)"]), n_rows),
+        "V201206": rng.choice(list(config.anes_ideology_labels) + [-4], n_rows),
+        "V201207": rng.choice(list(config.anes_ideology_labels), n_rows),
+        "US State 2": rng.choice(list(fips_labels.values()), n_rows),
+    })
+
+
+def time_stage(function, repeat):
+    '''
+    Runs function repeat times. Returns (its last result, a dict of timings in seconds and
+    the resident memory change of the first run in MB).
+    '''
+    durations = []
+    memory_delta = None
+    for i in range(repeat):
+        memory_before = memory_usage()
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+        if i == 0 and memory_before is not None:
+            memory_delta = (memory_usage() - memory_before) / 1e6
+
+    return result, {"best_s": min(durations), "median_s": float(np.median(durations)),
+                    "repeat": repeat, "memory_delta_mb": memory_delta}
+
+
+def benchmark_size(n_rows, repeat=3, seed=0, weights=False):
+    '''
+    Times every stage at one size. Returns {stage: timings}.
+    '''
+    raw = synthetic_cev(n_rows, seed=seed, weights=weights)
+    selected = (raw[[c for c in dict.fromkeys(config.selected_variables) if c in raw.columns]]
+                .rename(columns=config.rename_mapping))
+    decoder = CodeTableDecoder.from_config({"gestfips": fips_labels})
+
+    results = {}
+
+    decoded, results["decode"] = time_stage(
+        lambda: apply_schema(decoder.decode(selected)), repeat)
+
+    scored, results["add_engagement_score"] = time_stage(
+        lambda: config.add_engagement_score(decoded.copy()), repeat)
+
+    df, results["derived_columns"] = time_stage(lambda: add_derived_columns(scored), repeat)
+
+    def exclusion_stats():
+        stats = ExclusionStats(df)
+        return [stats.counts(column, metric) for column in config.variable_mapping
+                for metric in ["volunteer", "engagement"]]
+
+    _, results["exclusion_stats"] = time_stage(exclusion_stats, repeat)
+
+    cube, results["aggregate_cube"] = time_stage(lambda: build_aggregate_cube(df), repeat)
+
+    def dashboard_views():
+        return [(cube_metric(cube, column, metric, weighted=weighted),
+                 cube_exclusion_stats(cube, column, metric))
+                for column in config.variable_mapping
+                for metric in ["volunteer", "engagement"]
+                for weighted in [False, True]]
+
+    _, results["dashboard_views"] = time_stage(dashboard_views, repeat)
+
+    pairs, results["pair_index"] = time_stage(lambda: build_pair_index(df), repeat)
+    _, results["pair_views"] = time_stage(
+        lambda: [pair_metric(pairs, row, column, metric)
+                 for row in config.variable_mapping for column in config.variable_mapping
+                 if row != column for metric in ["volunteer", "engagement"]], repeat)
+
+    anes = synthetic_anes(n_rows, seed=seed)
+    crosswalked, results["anes_crosswalks"] = time_stage(
+        lambda: apply_crosswalks(anes.copy())[0], repeat)
+    _, results["anes_polar_tables"] = time_stage(
+        lambda: (polar_table(crosswalked), polar_table_by_party(crosswalked)), repeat)
+    spread_stats, results["anes_spread_stats"] = time_stage(
+        lambda: SpreadStats.from_frame(crosswalked), repeat)
+    _, results["anes_spread_bootstrap"] = time_stage(
+        lambda: spread_stats.bootstrap(n_boot=1000, seed=seed), repeat)
+
+    return results
+
+
+def run_metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {"run_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": commit, "python": platform.python_version(),
+            "pandas": pd.__version__, "numpy": np.__version__,
+            "machine": platform.machine(), "system": platform.system()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--weights", action="store_true",
+                        help="include the survey weights (161 float columns per row)")
+    parser.add_argument("--output", default="data/benchmarks.jsonl")
+    args = parser.parse_args()
+
+    metadata = run_metadata()
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    for n_rows in args.sizes:
+        results = benchmark_size(n_rows, repeat=args.repeat, seed=args.seed,
+                                 weights=args.weights)
+        with open(output, "a") as f:
+            for stage, timings in results.items():
+                f.write(json.dumps({**metadata, "rows": n_rows, "stage": stage,
+                                    "weights": args.weights, **timings}) + "\n")
+
+        print(f"\n{n_rows:,} rows")
+        for stage, timings in results.items():
+            print(f"  {stage:<24} {timings['best_s'] * 1000:>10.1f} ms")
+
+    print(f"\nResults appended to {output}")
+
+
+if __name__ == "__main__":
+    main()
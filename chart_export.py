@@ -0,0 +1,178 @@
+'''
+Exports every chart in the report at once: each (variable, metric, sort) view of the
+dashboard, plus every named analysis chart the notebook saved with save_chart_spec.
+
+    python chart_export.py                         # png, into the repo root
+    python chart_export.py --formats png pdf json  # several formats
+    python chart_export.py --force                 # re-render everything
+
+Charts are rendered on a pool of processes, each with its own vl-convert renderer that
+stays warm between charts. A chart is only rendered again when its Vega-Lite spec, which
+includes its data, has changed since the last export (see the manifest).
+'''
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+try:
+    import vl_convert as vlc
+except ImportError:
+    vlc = None
+
+
+# Where save_chart_spec puts the notebook's charts, and where the export remembers what it
+# rendered last time: {"<name>.<format>": spec hash}
+spec_dir = Path("data/chart_specs")
+manifest_path = Path("data/chart_specs/manifest.json")
+
+export_formats = ["png", "pdf", "svg", "json"]
+
+
+def save_chart_spec(chart, name, directory=spec_dir):
+    '''
+    Saves an Altair chart's Vega-Lite JSON as <directory>/<name>.vl.json for export_charts.
+    This is what the notebook calls instead of chart.save(..., format='png'), so running
+    the notebook doesn't start a renderer for every chart.
+    '''
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{name}.vl.json"
+    path.write_text(chart.to_json())
+    return path
+
+
+def analysis_jobs(directory=spec_dir):
+    '''
+    (name, spec) for every chart saved with save_chart_spec.
+    '''
+    return [(path.name[:-len(".vl.json")], path.read_text())
+            for path in sorted(Path(directory).glob("*.vl.json"))]
+
+
+def dashboard_jobs(backend, variables=None, metrics=("volunteer", "engagement")):
+    '''
+    (name, spec) for every (variable, metric, sort) view of the dashboard, named
+    dashboard/<variable>-<metric>[-sorted], with the data from a query backend (see
+    query_backend.py).
+    '''
+    from config import variable_mapping
+    from dashboard_charts import metric_chart_spec
+
+    variables = variables or variable_mapping
+    return [(f"dashboard/{column}-{metric}{'-sorted' if sort_bars else ''}",
+             metric_chart_spec(backend, column, variable_mapping[column], metric, sort_bars))
+            for column in variables for metric in metrics for sort_bars in [False, True]]
+
+
+def spec_hash(spec):
+    return hashlib.sha256(spec.encode()).hexdigest()
+
+
+def _start_renderer():
+    '''
+    Runs once in each worker process: the first conversion starts vl-convert's JavaScript
+    runtime, which the worker then reuses for every chart it renders.
+    '''
+    vlc.vegalite_to_svg({"mark": "point", "data": {"values": [{}]}})
+
+
+def _render(name, spec, formats, output, scale):
+    for file_format in formats:
+        path = Path(output) / f"{name}.{file_format}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if file_format == "json":
+            path.write_text(spec)
+        elif file_format == "svg":
+            path.write_text(vlc.vegalite_to_svg(spec))
+        elif file_format == "png":
+            path.write_bytes(vlc.vegalite_to_png(spec, scale=scale))
+        elif file_format == "pdf":
+            path.write_bytes(vlc.vegalite_to_pdf(spec))
+    return name
+
+
+def export_charts(jobs, output=".", formats=("png",), workers=None, scale=1, force=False,
+                  manifest=manifest_path):
+    '''
+    Renders (name, spec) jobs to <output>/<name>.<format> for each format, skipping files
+    whose spec hasn't changed since they were last exported. Returns {"rendered": [...],
+    "skipped": [...]} (chart names).
+    '''
+    unknown = set(formats) - set(export_formats)
+    if unknown:
+        raise ValueError(f"Unknown formats {sorted(unknown)}; use {export_formats}")
+
+    manifest = Path(manifest)
+    rendered_hashes = json.loads(manifest.read_text()) if manifest.exists() else {}
+
+    todo, skipped = [], []
+    for name, spec in jobs:
+        digest = spec_hash(spec)
+        stale = [file_format for file_format in formats
+                 if force or rendered_hashes.get(f"{name}.{file_format}") != digest
+                 or not (Path(output) / f"{name}.{file_format}").exists()]
+        if stale:
+            todo.append((name, spec, digest, stale))
+        else:
+            skipped.append(name)
+
+    # json is just the spec, so json-only exports don't start the renderers
+    needs_renderer = any(file_format != "json" for *_, stale in todo for file_format in stale)
+    if needs_renderer and vlc is None:
+        raise ImportError("Rendering png/pdf/svg needs vl-convert-python (see requirements.txt)")
+
+    rendered = []
+    try:
+        if todo:
+            with ProcessPoolExecutor(
+                    max_workers=min(workers or os.cpu_count() or 1, len(todo)),
+                    initializer=_start_renderer if needs_renderer else None) as pool:
+                futures = {pool.submit(_render, name, spec, stale, str(output), scale):
+                           (name, digest, stale) for name, spec, digest, stale in todo}
+                for future in as_completed(futures):
+                    name, digest, stale = futures[future]
+                    future.result()
+                    rendered.append(name)
+                    for file_format in stale:
+                        rendered_hashes[f"{name}.{file_format}"] = digest
+    finally:
+        # Whatever finished is remembered, even if a chart failed
+        manifest.parent.mkdir(parents=True, exist_ok=True)
+        manifest.write_text(json.dumps(rendered_hashes, indent=1, sort_keys=True))
+
+    return {"rendered": rendered, "skipped": skipped}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="data/cev_2021_cleaned.csv",
+                        help="cleaned data for the dashboard views (its aggregate cube is used)")
+    parser.add_argument("--output", default=".")
+    parser.add_argument("--formats", nargs="+", default=["png"], choices=export_formats)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--force", action="store_true", help="re-render unchanged charts too")
+    parser.add_argument("--no-dashboard", action="store_true",
+                        help="only the notebook's analysis charts")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    jobs = analysis_jobs()
+    if not args.no_dashboard:
+        from aggregates import load_aggregate_cube
+        from query_backend import CubeBackend
+        jobs += dashboard_jobs(CubeBackend(load_aggregate_cube(args.data)))
+
+    result = export_charts(jobs, args.output, args.formats, workers=args.workers,
+                           scale=args.scale, force=args.force)
+    print(f"Rendered {len(result['rendered'])} charts, {len(result['skipped'])} unchanged, "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
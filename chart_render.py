@@ -0,0 +1,115 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from spec_cache import SpecCache
+
+
+class ChartRenderer:
+    '''
+    Runs dashboard work (aggregation + building the Altair spec) on a thread pool shared by
+    every session on the worker, so the event loop stays free for the other sessions.
+
+    Finished results go into cache (a spec_cache.SpecCache, so it stays bounded), and work
+    in progress is tracked per key: a key that's cached or already running is never
+    submitted again, so sessions asking for the same view share one computation. Work that
+    nobody is waiting for any more (the user already picked something else) is cancelled
+    if it hasn't started yet.
+    '''
+
+    def __init__(self, cache=None, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="chart-render")
+        self.cache = cache if cache is not None else SpecCache()
+        self.running = {}
+        self.waiting = {}
+        # Reentrant: a done callback can run inside submit if the work finishes right away
+        self.lock = threading.RLock()
+
+    def submit(self, key, fn, *args):
+        '''
+        A concurrent.futures.Future for key: already resolved on a cache hit, the running
+        one if there is one, otherwise a new one for fn(*args). Every submit should be matched
+        by a release once the caller stops waiting.
+        '''
+        with self.lock:
+            self.waiting[key] = self.waiting.get(key, 0) + 1
+
+            future = self.running.get(key)
+            if future is not None:
+                return future
+
+            cached = self.cache.get(key)
+            if cached is not None:
+                future = Future()
+                future.set_result(cached)
+                return future
+
+            future = self.executor.submit(fn, *args)
+            self.running[key] = future
+            future.add_done_callback(lambda done: self._finished(key, done))
+            return future
+
+    def _finished(self, key, future):
+        with self.lock:
+            if self.running.get(key) is future:
+                del self.running[key]
+            if not future.cancelled() and future.exception() is None:
+                self.cache.put(key, future.result())
+
+    def release(self, key, cancel=False):
+        '''
+        One caller stopped waiting on key. With cancel=True, if nobody else is waiting and the
+        work hasn't started, it's cancelled.
+        '''
+        with self.lock:
+            self.waiting[key] = self.waiting.get(key, 1) - 1
+            if self.waiting[key] <= 0:
+                del self.waiting[key]
+                future = self.running.get(key)
+                if cancel and future is not None:
+                    future.cancel()
+
+
+class LatestRequest:
+    '''
+    Tracks the newest request for one output in one session. run() returns the result for
+    key, or None if a newer request came in while it was waiting (the caller should then
+    leave the output alone, e.g. with req(False, cancel_output=True)).
+    '''
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.version = 0
+        self.pending = None
+
+    async def run(self, key, fn, *args):
+        self.version += 1
+        version = self.version
+
+        # Whatever this output asked for before is stale now (it's only cancelled if it's
+        # for a different key and no other session is waiting on it)
+        if self.pending is not None:
+            self.renderer.release(self.pending, cancel=self.pending != key)
+
+        future = self.renderer.submit(key, fn, *args)
+        self.pending = key
+
+        try:
+            # shield: cancelling this await (e.g. the session closing) mustn't cancel work
+            # another session may be sharing
+            result = await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            # Our work was cancelled because a newer request replaced it
+            if version != self.version:
+                return None
+            raise
+        finally:
+            # A newer run has already released this one
+            if self.version == version:
+                self.renderer.release(key)
+                self.pending = None
+
+        if version != self.version:
+            return None
+        return result
@@ -0,0 +1,148 @@
+import hashlib
+from collections.abc import Mapping
+from types import MappingProxyType
+
+
+def enhance_mapping_dictionary(original_dict):
+    '''
+    I found out that the data dictionaries don't account for existing qualitative data, so
+    this is a function that will help augment our existing dictionaries to capture the times
+    where people ignore the numeric codes and write the qualitative data directly.
+    For example, if a column has a bunch of "1", "2, "5", "Female", "Metropolitan", etc., it
+    will convert the numeric codes while keeping the qualitative data.
+
+    This will augment all of the existing dictionaries below rather than having to manually
+    change all of them.
+    '''
+    enhanced_dict = original_dict.copy()
+    special_codes = {'-9', '-3', '-2', '-1', '.', '.u', '.r', '.n', '.d'}
+    # dict.fromkeys rather than a set, so the variants always come out in the same order
+    valid_values = dict.fromkeys(
+        v for k, v in original_dict.items()
+        if k not in special_codes and isinstance(v, str)
+        and v not in {'Missing', 'No Answer', 'Refused', 'Do Not Know', 'Not in Universe'})
+
+    for value in valid_values:
+        enhanced_dict[value.upper()] = value
+        enhanced_dict[value] = value
+        enhanced_dict[value.lower()] = value
+
+    return enhanced_dict
+
+
+# Built lookups, by content hash. They're shared by every CodeTable with the same content,
+# so re-importing config.py (importlib.reload in the notebook/pipeline) reuses them.
+_built_tables = {}
+
+
+class CodeTable(Mapping):
+    '''
+    A code table for one survey variable (raw code -> label), written down as a spec
+    instead of a filled-in dict:
+        - codes: {raw code: label}, as in the codebook
+        - ranges: (low, high) pairs for numeric answers; every whole number from low to high
+          is its own label (e.g. 1-500 hours volunteered), without listing 500 entries
+        - qualitative: also accept the labels themselves ('Yes', 'YES', 'yes'), like
+          enhance_mapping_dictionary
+
+    It works anywhere a {code: label} dict did (it's a read-only Mapping), but the full dict
+    is only built the first time something looks in it, and it's cached by content_hash().
+    Tables with the same content are equal and hash the same, so they can be used as keys.
+    '''
+
+    __slots__ = ("_codes", "_ranges", "_qualitative", "_content_hash")
+
+    def __init__(self, codes, ranges=(), qualitative=False):
+        self._codes = tuple(codes.items())
+        self._ranges = tuple((int(low), int(high)) for low, high in ranges)
+        self._qualitative = bool(qualitative)
+        self._content_hash = None
+
+    @property
+    def codes(self):
+        return dict(self._codes)
+
+    @property
+    def ranges(self):
+        return self._ranges
+
+    @property
+    def qualitative(self):
+        return self._qualitative
+
+    def spec(self):
+        return (self._codes, self._ranges, self._qualitative)
+
+    def content_hash(self):
+        '''
+        Short, stable hash of the table's content (the same across runs and reloads).
+        '''
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(repr(self.spec()).encode()).hexdigest()[:16]
+        return self._content_hash
+
+    def explicit_items(self):
+        '''
+        The (code, label) pairs that aren't range rules: the codes plus, for qualitative
+        tables, the label variants.
+        '''
+        codes = dict(self._codes)
+        if self._qualitative:
+            codes = enhance_mapping_dictionary(codes)
+        return codes.items()
+
+    def lookup(self):
+        '''
+        The whole table as a read-only {code: label} dict, with the ranges filled in (built
+        once per content).
+        '''
+        key = self.content_hash()
+        if key not in _built_tables:
+            table = dict(self.explicit_items())
+            for low, high in self._ranges:
+                for number in range(low, high + 1):
+                    table.setdefault(str(number), number)
+            _built_tables[key] = MappingProxyType(table)
+        return _built_tables[key]
+
+    def __getitem__(self, code):
+        return self.lookup()[code]
+
+    def __iter__(self):
+        return iter(self.lookup())
+
+    def __len__(self):
+        return len(self.lookup())
+
+    def __eq__(self, other):
+        if isinstance(other, CodeTable):
+            return self.spec() == other.spec()
+        return Mapping.__eq__(self, other)
+
+    def __hash__(self):
+        return hash(self.spec())
+
+    def __repr__(self):
+        return (f"CodeTable({self.codes!r}, ranges={list(self._ranges)!r}, "
+                f"qualitative={self._qualitative!r})")
+
+
+def table_hash(table):
+    '''
+    content_hash for a CodeTable, or the same kind of hash for a plain dict (e.g. the
+    pipeline's extra_tables).
+    '''
+    if isinstance(table, CodeTable):
+        return table.content_hash()
+    return hashlib.sha256(repr(sorted(table.items(), key=repr)).encode()).hexdigest()[:16]
+
+
+def codebook_hash(tables):
+    '''
+    Stable key for a set of code tables ({variable: table}): it changes when any table's
+    content changes, and only then, so caches of decoded data can use it.
+    '''
+    digest = hashlib.sha256()
+    for variable in sorted(tables, key=str):
+        digest.update(f"{variable}={table_hash(tables[variable])};".encode())
+    return digest.hexdigest()[:16]
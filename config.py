@@ -1,30 +1,11 @@
 # Note: PRSUPINT = had an interview with subject
 
+import numpy as np
 import pandas as pd
 
-
-def enhance_mapping_dictionary(original_dict):
-    '''
-    I found out that the data dictionaries don't account for existing qualitative data, so 
-    this is a function that will help augment our existing dictionaries to capture the times
-    where people ignore the numeric codes and write the qualitative data directly.
-    For example, if a column has a bunch of "1", "2, "5", "Female", "Metropolitan", etc., it 
-    will convert the numeric codes while keeping the qualitative data.
-
-    This will augment all of the existing dictionaries below rather than having to manually 
-    change all of them.
-    '''
-    enhanced_dict = original_dict.copy()
-    special_codes = {'-9', '-3', '-2', '-1', '.', '.u', '.r', '.n', '.d'}
-    valid_values = {v for k, v in original_dict.items()
-                    if k not in special_codes and v not in {'Missing', 'No Answer', 'Refused', 'Do Not Know', 'Not in Universe'}}
-
-    for value in valid_values:
-        enhanced_dict[value.upper()] = value
-        enhanced_dict[value] = value
-        enhanced_dict[value.lower()] = value
-
-    return enhanced_dict
+# enhance_mapping_dictionary lives in code_tables.py now; it's imported here so older code
+# that calls config.enhance_mapping_dictionary still works
+from code_tables import CodeTable, enhance_mapping_dictionary
 
 
 selected_variables = [
@@ -48,6 +29,16 @@ selected_variables = [
     "hefaminc", "peeduca", "gtmetsta", "pes7", "pes9"
 ]
 
+# CEV supplement person weight and its 160 replicate weights. The replicates use successive
+# difference replication, so a statistic's variance is 4/160 * the sum of its squared
+# replicate deviations (see survey_weights.py)
+weight_variables = ["pwsrwgt"] + [f"pwsrwgt{i}" for i in range(1, 161)]
+replicate_variance_factor = 4 / 160
+selected_variables = selected_variables + weight_variables
+
+# Identifies a person across the CEV and CPS files: household IDs plus the person's line number
+merge_keys = ["hrhhid", "hrhhid2", "pulineno"]
+
 # Rename the columns
 rename_mapping = {
     # Household Identifier Index
@@ -84,6 +75,42 @@ rename_mapping = {
     "gtmetsta": "Urban_Rural_Status"
 }
 
+rename_mapping.update({"pwsrwgt": "Person_Weight",
+                       **{f"pwsrwgt{i}": f"Replicate_Weight_{i}" for i in range(1, 161)}})
+weight_column = "Person_Weight"
+replicate_weight_columns = [f"Replicate_Weight_{i}" for i in range(1, 161)]
+
+# CEV supplement years that can be loaded side by side (see multi_year.py). The variables and
+# code tables above are the 2021 codebook; year_overrides lists where another year differs:
+#   "rename_mapping": raw variable -> column name, for variables named differently that year
+#   "tables": raw variable -> code table, replacing that variable's <variable>_dict
+#   "drop": variables the year doesn't have
+# A year only gets an entry once its codebook has been checked against 2021's (an empty entry
+# means "same as 2021"). Years without one can't be cleaned yet, since decoding them with the
+# 2021 tables would silently mislabel any code that changed.
+cev_years = [2017, 2019, 2021, 2023]
+year_overrides = {
+    2021: {},
+}
+
+# Variables shown in the shiny dashboard (column name: display name)
+variable_mapping = {
+    "Household_Size": "Household Size",
+    "US State": "US State",
+    "Family_Income_Level": "Family Income",
+    "Education_Level": "Education Level",
+    "Urban_Rural_Status": "Urban/Rural Status",
+    "Community_Improvement_Activities": "Community Involvement",
+    "Posted_Views_On_Social_Media": "Social Media Use",
+    "Age": "Age",
+    "Gender": "Gender",
+    "Race_Ethnicity": "Race/Ethnicity",
+    "Marital_Status": "Marital Status"
+}
+
+# Responses the dashboard leaves out of its charts (and reports as excluded)
+exclude_categories = ['No Answer', 'Refused', 'Do Not Know', 'Not in Universe']
+
 
 ###
 ###
@@ -183,31 +210,100 @@ def calculate_engagement_score(row):
     return score
 
 
-def add_engagement_score(df):
+# Weights (out of 100) for each engagement component, see calculate_engagement_score above
+engagement_weights = {
+    'Boycott_Based_On_Values': 30,
+    'Contacted_Public_Official': 30,
+    'Discussed_Issues_With_Neighbors': 15,
+    'Posted_Views_On_Social_Media': 15,
+    'Frequency_Of_News_Consumption': 10,
+}
+
+# Response -> component score (0-100). Anything not listed counts as an invalid response.
+yes_no_scores = {'Yes': 100, 'No': 0}
+
+frequency_scores = {
+    'Basically Every Day': 100,
+    'A Few Times a Week': 80,
+    'A Few Times a Month': 60,
+    'Once a Month': 40,
+    'Less Than Once a Month': 20,
+    'Not at All': 0,
+}
+
+engagement_component_scores = {
+    'Boycott_Based_On_Values': yes_no_scores,
+    'Contacted_Public_Official': yes_no_scores,
+    'Discussed_Issues_With_Neighbors': frequency_scores,
+    'Posted_Views_On_Social_Media': frequency_scores,
+    'Frequency_Of_News_Consumption': frequency_scores,
+}
+
+engagement_level_labels = ["Very Low Engagement", "Low Engagement", "Moderate Engagement",
+                           "High Engagement", "Very High Engagement"]
+
+
+def calculate_engagement_scores(df, weights=None, min_valid_share=0.6):
+    """
+    Columnar version of calculate_engagement_score: scores every respondent at once instead
+    of calling a Python function per row.
+
+    Each component column is turned into positions in its list of valid responses,
+    and the codes are used to index into a NumPy array of component scores. Codes of -1 (anything
+    that isn't a valid response, e.g. 'Refusal' or NaN) count as invalid, same as the row function.
+
+    weights maps column name -> weight out of 100 (defaults to engagement_weights). Every
+    column needs its valid responses in engagement_component_scores (a KeyError otherwise).
+    Columns missing from df are treated as unanswered. Returns a float Series with NaN where
+    fewer than min_valid_share of the components have valid responses.
+    """
+    if weights is None:
+        weights = engagement_weights
+
+    unknown = [column for column in weights if column not in engagement_component_scores]
+    if unknown:
+        raise KeyError(f"No component scores for {unknown}; add them to "
+                       "engagement_component_scores")
+
+    score = np.zeros(len(df))
+    valid_responses = np.zeros(len(df), dtype=np.int64)
+
+    for column, weight in weights.items():
+        if column not in df.columns:
+            continue
+        response_scores = engagement_component_scores[column]
+        codes = pd.Index(list(response_scores)).get_indexer(df[column])
+        is_valid = codes >= 0
+        component = np.array(list(response_scores.values()), dtype=float)[codes]
+        score += np.where(is_valid, component * (weight / 100), 0)
+        valid_responses += is_valid
+
+    score[valid_responses < (len(weights) * min_valid_share)] = np.nan
+
+    return pd.Series(score, index=df.index)
+
+
+def score_to_engagement_level(scores):
+    """
+    Bins engagement scores into the engagement_level categories (20-point bins, with
+    "Insufficient Data" for missing scores).
+    """
+    levels = pd.cut(scores, bins=[-np.inf, 20, 40, 60, 80, np.inf],
+                    right=False, labels=engagement_level_labels)
+
+    return levels.cat.add_categories("Insufficient Data").fillna("Insufficient Data")
+
+
+def add_engagement_score(df, weights=None):
     """
     Adds the political engagement score column to the dataframe.
     """
     # Calculate scores
-    df['political_engagement_score'] = df.apply(
-        calculate_engagement_score, axis=1)
+    df['political_engagement_score'] = calculate_engagement_scores(df, weights)
 
     # Add categorical labels based on score ranges
-    def score_to_category(score):
-        if pd.isna(score):
-            return "Insufficient Data"
-        if score >= 80:
-            return "Very High Engagement"
-        elif score >= 60:
-            return "High Engagement"
-        elif score >= 40:
-            return "Moderate Engagement"
-        elif score >= 20:
-            return "Low Engagement"
-        else:
-            return "Very Low Engagement"
-
-    df['engagement_level'] = df['political_engagement_score'].apply(
-        score_to_category)
+    df['engagement_level'] = score_to_engagement_level(
+        df['political_engagement_score'])
 
     return df
 
@@ -227,7 +323,7 @@ default_dict = {
 # Renaming pes16 - Volunteered Past Year
 # In the past 12 months, did [you/[NAME]] spend any time volunteering for any organization or association?
 
-pes16_dict = {
+pes16_dict = CodeTable({
     '1': 'Yes',
     '2': 'No',
     '-1': 'Not in Universe',
@@ -240,12 +336,10 @@ pes16_dict = {
     '.d': 'Do Not Know',
     'Yes': 'Yes',
     'No': 'No'
-}
-
-pes16_dict = enhance_mapping_dictionary(pes16_dict)
+}, qualitative=True)
 
 # Renaming pes16d - Volunteering Frequency
-pes16d_dict = {
+pes16d_dict = CodeTable({
     '-9': 'No Answer',
     '-3': 'Refusal',
     '-2': 'Do Not Know',
@@ -257,18 +351,15 @@ pes16d_dict = {
     '5': 'Less Than Once a Month',
     '6': 'Not at All',
     None: 'Missing'
-}
-
-pes16d_dict = enhance_mapping_dictionary(pes16d_dict)
+}, qualitative=True)
 
-pts16e_dict = default_dict.copy()
-for i in range(1, 501):
-    pts16e_dict[str(i)] = i
+# Hours volunteered: 1-500 hours are their own value
+pts16e_dict = CodeTable(default_dict, ranges=[(1, 500)])
 
 
 # Renaming pes2 - Discussed Issues with Friends/Family
 # [In the past 12 months,] how often did [you/[NAME] discuss political, societal, or local issues with friends or family?
-pes2_dict = {
+pes2_dict = CodeTable({
     '1': 'Basically Every Day',
     '2': 'A Few Times a Week',
     '3': 'A Few Times a Month',
@@ -283,12 +374,11 @@ pes2_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
+}, qualitative=True)
 
-pes2_dict = enhance_mapping_dictionary(pes2_dict)
 # Renaming pes5 - Discussed Issues with Neighbors
 # [In the past 12 months,] how often did [you/[NAME]] discuss political, societal, or local issues with [your/his/her] neighbors?
-pes5_dict = {
+pes5_dict = CodeTable({
     '1': 'Basically Every Day',
     '2': 'A Few Times a Week',
     '3': 'A Few Times a Month',
@@ -303,14 +393,12 @@ pes5_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-pes5_dict = enhance_mapping_dictionary(pes5_dict)
+}, qualitative=True)
 
 # Renaming pes13 - Contacted Public Official
 # [In the past 12 months,] did [you/[NAME]] contact or visit a public official – at any level of government – to express [your/his/her] opinion?
 
-pes13_dict = {
+pes13_dict = CodeTable({
     '1': 'Yes',
     '2': 'No',
     '-9': 'No Answer',
@@ -321,13 +409,11 @@ pes13_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-pes13_dict = enhance_mapping_dictionary(pes13_dict)
+}, qualitative=True)
 
 # Renaming pes14 - Boycott Based on Values
 # [In the past 12 months,] Did [you/[NAME]] buy or boycott products or services based on the political values or business practices of that company?
-pes14_dict = {
+pes14_dict = CodeTable({
     '1': 'Yes',
     '2': 'No',
     '-9': 'No Answer',
@@ -338,13 +424,11 @@ pes14_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-pes14_dict = enhance_mapping_dictionary(pes14_dict)
+}, qualitative=True)
 
 # Renaming pes15 - Belonged to Groups
 # [In the past 12 months,] did [you/[NAME]] belong to any groups, organizations, or associations?
-pes15_dict = {
+pes15_dict = CodeTable({
     '1': 'Yes',
     '2': 'No',
     '-9': 'No Answer',
@@ -355,13 +439,11 @@ pes15_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-pes15_dict = enhance_mapping_dictionary(pes15_dict)
+}, qualitative=True)
 
 # Renaming pes7 - Community Improvement Activities
 # [In the past 12 months,] did [you/[NAME]] get together with other people from [your/his/her] neighborhood to do something positive for [your/his/her] neighborhood or the community?
-pes7_dict = {
+pes7_dict = CodeTable({
     '1': 'Yes',
     '2': 'No',
     '-9': 'No Answer',
@@ -373,13 +455,11 @@ pes7_dict = {
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
     None: 'Missing',
-}
-
-pes7_dict = enhance_mapping_dictionary(pes7_dict)
+}, qualitative=True)
 
 # Renaming pes11 - Voted in Local Election
 # [In the past 12 months,] did [you/[NAME]] vote in the last local elections, such as for mayor or school board?
-pes11_dict = {
+pes11_dict = CodeTable({
     '1': 'Yes',
     '2': 'No',
     '-9': 'No Answer',
@@ -390,13 +470,11 @@ pes11_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-pes11_dict = enhance_mapping_dictionary(pes11_dict)
+}, qualitative=True)
 
 # Renaming pes9 - Posted Views on Social Media
 # [In the past 12 months,] how often did [you/[NAME]] post [your/his/her] views about political, societal, or local issues on the internet or social media?
-pes9_dict = {
+pes9_dict = CodeTable({
     '1': 'Basically Every Day',
     '2': 'A Few Times a Week',
     '3': 'A Few Times a Month',
@@ -411,13 +489,11 @@ pes9_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-pes9_dict = enhance_mapping_dictionary(pes9_dict)
+}, qualitative=True)
 
 # Renaming pes10 - Frequency of News Consumption
 # [In the past 12 months,] how often did [you/[NAME]] read, watch or listen to news or information about political, societal, or local issues?
-pes10_dict = {
+pes10_dict = CodeTable({
     '1': 'Basically Every Day',
     '2': 'A Few Times a Week',
     '3': 'A Few Times a Month',
@@ -432,20 +508,14 @@ pes10_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-pes10_dict = enhance_mapping_dictionary(pes10_dict)
+}, qualitative=True)
 
 # Renaming prtage - Age
-prtage_dict = default_dict.copy()
-for i in range(1, 80):
-    prtage_dict[str(i)] = i
-prtage_dict['80'] = '80-84'
-prtage_dict['85'] = '85+'
-prtage_dict['.'] = 'Missing'
+prtage_dict = CodeTable({**default_dict, '80': '80-84', '85': '85+', '.': 'Missing'},
+                        ranges=[(1, 79)])
 
 # Renaming pesex - Gender
-pesex_dict = {
+pesex_dict = CodeTable({
     '-9': 'No Answer',
     '-3': 'Refused',
     '-2': 'Do Not Know',
@@ -453,12 +523,10 @@ pesex_dict = {
     '1': 'Male',
     '2': 'Female',
     '.': 'Missing'
-}
-
-pesex_dict = enhance_mapping_dictionary(pesex_dict)
+}, qualitative=True)
 
 # Renaming ptdtrace - Race/Ethnicity
-ptdtrace_dict = {
+ptdtrace_dict = CodeTable({
     '-9': 'No Answer',
     '-3': 'Refused',
     '-2': 'Do Not Know',
@@ -493,12 +561,10 @@ ptdtrace_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-ptdtrace_dict = enhance_mapping_dictionary(ptdtrace_dict)
+}, qualitative=True)
 
 # Renaming pemaritl - Marital Status
-pemaritl_dict = {
+pemaritl_dict = CodeTable({
     '-9': 'No Answer',
     '-3': 'Refused',
     '-2': 'Do Not Know',
@@ -514,17 +580,13 @@ pemaritl_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-pemaritl_dict = enhance_mapping_dictionary(pemaritl_dict)
+}, qualitative=True)
 
 # Renaming hrnumhou - Household Size
-hrnumhou_dict = default_dict.copy()
-for i in range(1, 17):
-    hrnumhou_dict[str(i)] = i
+hrnumhou_dict = CodeTable(default_dict, ranges=[(1, 16)])
 
 # Renaming hefaminc - Family Income Level
-hefaminc_dict = {
+hefaminc_dict = CodeTable({
     '-9': 'No Answer',
     '-3': 'Refused',
     '-2': 'Do Not Know',
@@ -550,12 +612,10 @@ hefaminc_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-hefaminc_dict = enhance_mapping_dictionary(hefaminc_dict)
+}, qualitative=True)
 
 # Renaming peeduca - Education Level
-peeduca_dict = {
+peeduca_dict = CodeTable({
     '-9': 'No Answer',
     '-3': 'Refused',
     '-2': 'Do Not Know',
@@ -581,13 +641,11 @@ peeduca_dict = {
     '.r': 'Refusal',
     '.n': 'Not in Universe',
     '.d': 'Do Not Know',
-}
-
-peeduca_dict = enhance_mapping_dictionary(peeduca_dict)
+}, qualitative=True)
 
 
 # Renaming gtmetsta - Urban/Rural Status
-gtmetsta_dict = {
+gtmetsta_dict = CodeTable({
     '-9': 'No Answer',
     '-3': 'Refused',
     '-2': 'Do Not Know',
@@ -596,6 +654,59 @@ gtmetsta_dict = {
     '2': 'Nonmetropolitan',
     '3': 'Not Identified',
     '.': 'Missing'
+}, qualitative=True)
+
+
+###
+# ANES 2020 crosswalks
+###
+
+# ANES question -> {new column: {code: value}}. Each question can feed several columns
+# (e.g. party placement gets both a label and a position on the -3 to 3 scale).
+
+# Ideology labels shared by V201200 (self-placement), V201206 and V201207 (party placement)
+anes_ideology_labels = {
+    -9: "Refused",
+    -8: "Don't Know",
+    1: "Extremely Liberal",
+    2: "Liberal",
+    3: "Slightly Liberal",
+    4: "Moderate; middle of the road",
+    5: "Slightly Conservative",
+    6: "Conservative",
+    7: "Extremely Conservative",
 }
 
-gtmetsta_dict = enhance_mapping_dictionary(gtmetsta_dict)
+# Position on the spectrum: -3 to -1 liberal, 0 moderate, 1 to 3 conservative
+# (refusals/don't knows are 0 and get filtered out before averaging)
+anes_party_positions = {-9: 0, -8: 0, 1: -3, 2: -2, 3: -1, 4: 0, 5: 1, 6: 2, 7: 3}
+
+anes_crosswalks = {
+    # V201200 - Where would you place yourself on this scale, or haven't you thought much about this?
+    "V201200": {
+        "Ideology_(V201200)": {**anes_ideology_labels, 99: "Haven’t thought much about this"},
+    },
+    # V201228 - Generally speaking, do you usually think of yourself as a Democrat, a Republican, an independent, or what?
+    "V201228": {
+        "Party_Affiliation_(V201228)": {
+            -9: "Refused",
+            -8: "Don't know",
+            -4: "Technical error",
+            0: "No Preference",
+            1: "Democrat",
+            2: "Republican",
+            3: "Independent",
+            5: "Other party",
+        },
+    },
+    # V201206 - Where would you place the Democratic Party on this scale?
+    "V201206": {
+        "Dem_Ideology_(V201206)": anes_ideology_labels,
+        "Dem_Positioning(V201206)": anes_party_positions,
+    },
+    # V201207 - Where would you place the Republican Party on this scale?
+    "V201207": {
+        "Repub_Ideology_(V201207)": anes_ideology_labels,
+        "Repub_Positioning(V201207)": anes_party_positions,
+    },
+}
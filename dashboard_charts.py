@@ -0,0 +1,166 @@
+import altair as alt
+import pandas as pd
+
+import config
+from instrumentation import metrics
+
+
+metric_titles = {
+    "volunteer": ("Percentage Volunteered", "Volunteer Rate (%)"),
+    "engagement": ("Average Political Engagement Score", "Engagement Score"),
+}
+
+
+def metric_chart(backend, column, display_name, metric_type, sort_bars=False, weighted=False):
+    '''
+    The dashboard's bar chart for one variable (column, labelled display_name), with the
+    data from a query backend (see query_backend.py). This is everything volunteer_plot
+    used to do inline, so it can run off the event loop (see chart_render.py) or outside
+    the app.
+    '''
+    return bar_chart(query_metric(backend, column, display_name, metric_type, weighted),
+                     display_name, metric_type, sort_bars, weighted)
+
+
+def query_metric(backend, column, display_name, metric_type, weighted=False):
+    # Age is charted by age group, see dashboard_columns in features.py
+    with metrics.timed("query_metric"):
+        return (backend.metric(column, metric_type, config.exclude_categories,
+                               weighted=weighted)
+                .rename(columns={'category': display_name}))
+
+
+def bar_chart(metric_data, display_name, metric_type, sort_bars=False, weighted=False):
+    '''
+    metric_chart's chart, from the already queried metric_data.
+    '''
+    # Several survey years (see multi_year.py) come back with a Year column: one bar per
+    # year within each category
+    by_year = "Year" in metric_data.columns
+
+    y_title, tooltip_title = metric_titles.get(metric_type, metric_titles["engagement"])
+
+    # No rows (e.g. every respondent excluded): the chart says so
+    if metric_data.empty:
+        return alt.Chart(pd.DataFrame({'No Data': [1]})).mark_text(
+            text=f"No data available for {display_name}"
+        ).encode()
+
+    # Sort if requested
+    if sort_bars:
+        metric_data = metric_data.sort_values(
+            'Metric_Value', ascending=False)
+
+    # With several years the categories keep their order across years, so a sort uses the
+    # category's mean over the years
+    x = alt.X(display_name, title=display_name,
+              sort=alt.EncodingSortField(
+              field='Metric_Value',
+              op='mean',
+              order='descending'
+              ) if sort_bars else None,
+              axis=alt.Axis(labelAngle=45))
+    year_encoding = ({"xOffset": alt.XOffset('Year:N'), "color": alt.Color('Year:N')}
+                     if by_year else {})
+
+    chart = alt.Chart(metric_data).mark_bar().encode(
+        x=x,
+        y=alt.Y('Metric_Value', title=y_title),
+        tooltip=[
+            alt.Tooltip(display_name),
+            *([alt.Tooltip('Year:N')] if by_year else []),
+            alt.Tooltip('Metric_Value',
+                        title=tooltip_title, format='.1f')
+        ],
+        **year_encoding
+    )
+
+    # Weighted estimates get error bars from the replicate weights (see survey_weights.py)
+    if weighted:
+        error_bars = alt.Chart(metric_data).mark_rule().encode(
+            x=x,
+            y='Lower',
+            y2='Upper',
+            **({"xOffset": alt.XOffset('Year:N')} if by_year else {})
+        )
+        chart = chart + error_bars
+
+    return chart.properties(
+        title=f"{y_title} by {display_name}",
+        width=600,
+        height=300
+    )
+
+
+def pair_heatmap(backend, row_column, row_name, column_column, column_name, metric_type):
+    '''
+    The drill-down view: a heatmap of the metric by two variables at once (rows labelled
+    row_name, columns column_name), from the backend's pair index. Respondent counts are in
+    the tooltip, since some cells are small. Several survey years are shown side by side.
+    '''
+    return heatmap_chart(query_pair_metric(backend, row_column, row_name, column_column,
+                                           column_name, metric_type),
+                         row_name, column_name, metric_type)
+
+
+def query_pair_metric(backend, row_column, row_name, column_column, column_name, metric_type):
+    with metrics.timed("query_pair_metric"):
+        return (backend.pair_metric(row_column, column_column, metric_type,
+                                    config.exclude_categories)
+                .rename(columns={'row_category': row_name, 'column_category': column_name}))
+
+
+def heatmap_chart(pair_data, row_name, column_name, metric_type):
+    '''
+    pair_heatmap's chart, from the already queried pair_data.
+    '''
+    by_year = "Year" in pair_data.columns
+
+    y_title, tooltip_title = metric_titles.get(metric_type, metric_titles["engagement"])
+
+    # No cells (e.g. every respondent excluded for one of the two): the chart says so
+    if pair_data.empty:
+        return alt.Chart(pd.DataFrame({'No Data': [1]})).mark_text(
+            text=f"No data available for {row_name} by {column_name}"
+        ).encode()
+
+    # Keep the categories in axis order (the data comes sorted)
+    heatmap = alt.Chart(pair_data).mark_rect().encode(
+        x=alt.X(column_name, title=column_name, sort=None, axis=alt.Axis(labelAngle=45)),
+        y=alt.Y(row_name, title=row_name, sort=None),
+        color=alt.Color('Metric_Value', title=tooltip_title),
+        tooltip=[
+            alt.Tooltip(row_name),
+            alt.Tooltip(column_name),
+            *([alt.Tooltip('Year:N')] if by_year else []),
+            alt.Tooltip('Metric_Value', title=tooltip_title, format='.1f'),
+            alt.Tooltip('count', title='Respondents')
+        ]
+    ).properties(width=600 if not by_year else 300, height=300)
+
+    title = f"{y_title} by {row_name} and {column_name}"
+    if by_year:
+        return heatmap.facet(column=alt.Column('Year:N')).properties(title=title)
+    return heatmap.properties(title=title)
+
+
+def metric_chart_spec(backend, column, display_name, metric_type, sort_bars=False,
+                      weighted=False):
+    '''
+    metric_chart serialized to Vega-Lite JSON, which is what gets cached. The query is
+    timed as query_metric and only building and serializing the chart as chart_spec.
+    '''
+    metric_data = query_metric(backend, column, display_name, metric_type, weighted)
+    with metrics.timed("chart_spec"):
+        return bar_chart(metric_data, display_name, metric_type, sort_bars,
+                         weighted).to_json()
+
+
+def pair_heatmap_spec(backend, row_column, row_name, column_column, column_name, metric_type):
+    '''
+    pair_heatmap serialized to Vega-Lite JSON, for the cache (timed like metric_chart_spec).
+    '''
+    pair_data = query_pair_metric(backend, row_column, row_name, column_column, column_name,
+                                  metric_type)
+    with metrics.timed("chart_spec"):
+        return heatmap_chart(pair_data, row_name, column_name, metric_type).to_json()
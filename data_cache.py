@@ -0,0 +1,129 @@
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+
+from schema import read_cleaned_csv, wanted_columns
+
+# pyarrow is only needed for the parquet cache; without it everything falls back to the csv
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+source_hash_key = b"source_sha256"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    '''
+    sha256 of a file's contents, read in chunks so large csvs don't need to fit in memory.
+    '''
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(csv_path):
+    return Path(csv_path).with_suffix(".parquet")
+
+
+def cached_source_hash(parquet_path):
+    '''
+    Returns the source csv hash stored in the parquet file's metadata (None if there isn't one).
+    '''
+    if pq is None or not Path(parquet_path).exists():
+        return None
+
+    metadata = pq.read_schema(parquet_path).metadata or {}
+    source_hash = metadata.get(source_hash_key)
+    return source_hash.decode() if source_hash else None
+
+
+def select_columns(available, columns):
+    '''
+    The requested columns plus their missing-reason and derived columns, in file order.
+    '''
+    wanted = wanted_columns(columns)
+    return [c for c in available if c in wanted]
+
+
+def write_cache(df, csv_path, source_hash=None):
+    '''
+    Writes df (already in the schema.py dtypes) to a parquet file next to csv_path, tagged
+    with the hash of the csv it was built from (source_hash, if the caller already has it).
+    Returns the parquet path, or None if pyarrow isn't installed.
+    '''
+    if pa is None:
+        return None
+
+    parquet_path = cache_path(csv_path)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        source_hash_key: (source_hash or file_hash(csv_path)).encode(),
+    })
+    pq.write_table(table, parquet_path)
+
+    return parquet_path
+
+
+def fresh_cache_path(csv_path, source_hash=None):
+    '''
+    The parquet cache for csv_path, for code that reads the parquet file directly (e.g.
+    query_backend.ArrowBackend). It's rebuilt from the csv first if it's missing or was built
+    from a different version of the csv. source_hash is the csv's file_hash, if the caller
+    already has it.
+    '''
+    if pq is None:
+        raise ImportError("The parquet cache needs pyarrow")
+
+    parquet_path = cache_path(csv_path)
+    source_hash = source_hash or file_hash(csv_path)
+    if cached_source_hash(parquet_path) != source_hash:
+        write_cache(read_cleaned_csv(csv_path), csv_path, source_hash)
+    return parquet_path
+
+
+def write_cleaned_data(df, csv_path):
+    '''
+    Export step for the cleaned data: writes the csv and the typed parquet cache next to it.
+    Returns the csv's hash, for the other files written next to it.
+    '''
+    df.to_csv(csv_path, index=False)
+    source_hash = file_hash(csv_path)
+    write_cache(df, csv_path, source_hash)
+    return source_hash
+
+
+def load_cleaned_data(csv_path, columns=None, source_hash=None):
+    '''
+    Loads the cleaned data, preferring the parquet cache next to csv_path. The cache is used
+    only if its stored hash matches the current csv; otherwise the csv is read through the
+    schema and the cache is rebuilt. columns optionally limits which columns are loaded
+    (missing-reason columns for numeric variables come along automatically). source_hash
+    is the csv's file_hash, if the caller already has it.
+    '''
+    parquet_path = cache_path(csv_path)
+    source_hash = source_hash or file_hash(csv_path)
+
+    if pq is not None and cached_source_hash(parquet_path) == source_hash:
+        if columns is not None:
+            columns = select_columns(pq.read_schema(parquet_path).names, columns)
+        return pd.read_parquet(parquet_path, columns=columns)
+
+    df = read_cleaned_csv(csv_path)
+    try:
+        write_cache(df, csv_path, source_hash)
+    except OSError as e:
+        # e.g. a read-only deployment; the csv still works, just slower
+        print(f"Could not write parquet cache for {csv_path}: {e}")
+
+    if columns is not None:
+        df = df[select_columns(df.columns, columns)]
+
+    return df
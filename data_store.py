@@ -0,0 +1,206 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_cache import file_hash, load_cleaned_data, select_columns, source_hash_key
+
+# Like the parquet cache, the shared store needs pyarrow; without it we load a private copy
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# Bumped whenever the column layout below changes, so older stores get rebuilt
+store_format = b"2"
+store_format_key = b"store_format"
+layout_key = b"layout"
+mask_suffix = "__mask"
+
+# Nullable pandas arrays (values + missing mask), e.g. Int64 and boolean
+masked_arrays = (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)
+
+
+def store_path(csv_path):
+    return Path(csv_path).with_suffix(".arrow")
+
+
+def stored_source_hash(path):
+    '''
+    Returns the source csv hash stored in the arrow file's metadata (None if there isn't one,
+    or the file has an older layout).
+    '''
+    if pa is None or not Path(path).exists():
+        return None
+
+    with pa.memory_map(str(path)) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    source_hash = metadata.get(source_hash_key)
+    if not source_hash or metadata.get(store_format_key) != store_format:
+        return None
+    return source_hash.decode()
+
+
+def _store_columns(name, series):
+    '''
+    The arrow column(s) for one pandas column, laid out so DataStore.column can wrap the
+    mapped buffers in numpy without copying them: categoricals as their integer codes (-1 for
+    missing) with the categories in the field metadata, floats with NaN rather than nulls,
+    nullable (masked) columns as their values plus a separate mask column, and bools as
+    uint8. Anything else (e.g. strings) is stored as a regular arrow column.
+
+    Returns a list of (field, array).
+    '''
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        layout = {"kind": "categorical", "categories": dtype.categories.tolist(),
+                  "ordered": bool(dtype.ordered)}
+        values = series.cat.codes.to_numpy()
+    elif isinstance(series.array, masked_arrays):
+        layout = {"kind": "masked", "dtype": str(dtype)}
+        values = series.to_numpy(dtype=dtype.numpy_dtype, na_value=0)
+        mask = series.isna().to_numpy().view(np.uint8)
+        if values.dtype == bool:
+            values = values.view(np.uint8)
+        return [(pa.field(name, pa.from_numpy_dtype(values.dtype),
+                          metadata={layout_key: json.dumps(layout)}), pa.array(values)),
+                (pa.field(f"{name}{mask_suffix}", pa.uint8()), pa.array(mask))]
+    elif dtype == bool:
+        layout = {"kind": "bool"}
+        values = series.to_numpy().view(np.uint8)
+    elif isinstance(dtype, np.dtype) and dtype.kind in "iuf":
+        layout = {"kind": "numpy"}
+        values = series.to_numpy()
+    else:
+        array = pa.array(series, from_pandas=True)
+        return [(pa.field(name, array.type), array)]
+
+    # from_pandas=False keeps NaN as NaN, so float columns have no validity bitmap
+    return [(pa.field(name, pa.from_numpy_dtype(values.dtype),
+                      metadata={layout_key: json.dumps(layout)}),
+             pa.array(values, from_pandas=False))]
+
+
+def build_store(csv_path, source_hash=None):
+    '''
+    Writes the cleaned data to an uncompressed arrow IPC file next to csv_path, which is what
+    lets every worker memory-map it. The file is written to a temporary name and renamed into
+    place, so a worker never maps a half-written store.
+    '''
+    path = store_path(csv_path)
+    source_hash = source_hash or file_hash(csv_path)
+    df = load_cleaned_data(csv_path, source_hash=source_hash)
+
+    columns = [column for name in df.columns for column in _store_columns(name, df[name])]
+    schema = pa.schema([field for field, _ in columns], metadata={
+        source_hash_key: source_hash.encode(),
+        store_format_key: store_format,
+    })
+    table = pa.Table.from_arrays([array for _, array in columns], schema=schema)
+
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with pa.OSFile(str(temp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+
+    return path
+
+
+class DataStore:
+    '''
+    Read-only view of the cleaned dataset shared by every worker process on a machine.
+
+    The data lives in one uncompressed arrow file that each process memory-maps, so the
+    column buffers are backed by the OS page cache and shared between workers. column()
+    wraps those buffers in numpy arrays instead of converting them (see _store_columns), so
+    a worker's Series point into the shared pages rather than into a private copy; only
+    columns stored in plain arrow form (none in the cleaned data) are converted.
+    '''
+
+    def __init__(self, table):
+        self.table = table
+        self._columns = {}
+
+    @classmethod
+    def attach(cls, csv_path, source_hash=None):
+        '''
+        Maps the store for csv_path, (re)building it first if it's missing or stale.
+        source_hash is the csv's file_hash, if the caller already has it.
+        '''
+        path = store_path(csv_path)
+        source_hash = source_hash or file_hash(csv_path)
+        if stored_source_hash(path) != source_hash:
+            build_store(csv_path, source_hash)
+
+        # The table's buffers keep the mapping alive after the file handle is closed
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+        return cls(table)
+
+    @property
+    def columns(self):
+        return [name for name in self.table.column_names if not name.endswith(mask_suffix)]
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def _buffer(self, name):
+        '''
+        A column's values as a read-only numpy view of the mapped file.
+        '''
+        column = self.table.column(name)
+        array = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        return array.to_numpy(zero_copy_only=True)
+
+    def column(self, name):
+        '''
+        One column as a pandas Series over the mapped buffers (built on first use, then
+        cached; the cache only holds the small pandas wrappers).
+        '''
+        if name not in self._columns:
+            metadata = self.table.schema.field(name).metadata or {}
+            layout = json.loads(metadata[layout_key]) if layout_key in metadata else {}
+            kind = layout.get("kind")
+
+            if kind == "categorical":
+                values = pd.Categorical.from_codes(
+                    self._buffer(name),
+                    dtype=pd.CategoricalDtype(layout["categories"], ordered=layout["ordered"]))
+            elif kind == "masked":
+                data = self._buffer(name)
+                mask = self._buffer(f"{name}{mask_suffix}").view(bool)
+                dtype = pd.api.types.pandas_dtype(layout["dtype"])
+                if dtype == "boolean":
+                    data = data.view(bool)
+                values = dtype.construct_array_type()(data, mask)
+            elif kind == "bool":
+                values = self._buffer(name).view(bool)
+            elif kind == "numpy":
+                values = self._buffer(name)
+            else:
+                values = self.table.column(name).to_pandas()
+
+            self._columns[name] = pd.Series(values, name=name, copy=False)
+        return self._columns[name]
+
+    def to_pandas(self, columns=None):
+        '''
+        A DataFrame with the given columns (plus their missing-reason columns), sharing the
+        column buffers (copy=False, so pandas doesn't copy them into blocks).
+        '''
+        names = self.columns if columns is None else select_columns(self.columns, columns)
+        return pd.DataFrame({name: self.column(name) for name in names}, copy=False)
+
+
+def load_shared_data(csv_path, columns=None, source_hash=None):
+    '''
+    Row-level data for the app: from the shared store when pyarrow is available, otherwise
+    a private copy via load_cleaned_data.
+    '''
+    if pa is None:
+        return load_cleaned_data(csv_path, columns=columns, source_hash=source_hash)
+    return DataStore.attach(csv_path, source_hash).to_pandas(columns)
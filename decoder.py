@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+
+import config
+from code_tables import CodeTable
+
+
+# Compiled CodeTables, by content hash, so rebuilding a decoder (e.g. after reloading
+# config.py) doesn't compile the same tables again
+_compiled_tables = {}
+
+# Changes whenever the same tables would decode differently (e.g. missing values now get
+# the table's None label), so the pipeline's cached decode output gets redone
+decode_version = 2
+
+
+def normalize_code(value):
+    '''
+    Normalizes a raw survey value so that the different ways the same code shows up in the data
+    all look the same: 1, 1.0, "1", " 1 " and "01" all become "1", and qualitative entries are
+    stripped and lowercased ("Female", "FEMALE" -> "female").
+    Returns None for missing values.
+    '''
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+
+    text = str(value).strip()
+    if text.lower() in {'', 'nan', 'none'}:
+        return None
+
+    try:
+        number = float(text)
+    except ValueError:
+        return text.lower()
+
+    if number.is_integer():
+        return str(int(number))
+    return text.lower()
+
+
+class CodeTableDecoder:
+    '''
+    Translates the numeric survey codes into labels using the *_dict tables in config.py.
+
+    The tables are compiled once into normalized lookups, so the enhanced upper/lower/original
+    variants from enhance_mapping_dictionary collapse into one key each. Decoding a column then
+    only touches its distinct values (via pd.factorize), and the result is mapped back onto
+    every row with an array lookup and returned as a pandas Categorical.
+
+    The numeric ranges of a CodeTable (e.g. 1-500 hours) stay rules: a value in the range is
+    looked up by its number instead of through one entry per code.
+    '''
+
+    def __init__(self, tables, rename_mapping=None):
+        self.rename_mapping = dict(rename_mapping or {})
+        self.tables = {}
+
+        for column, table in tables.items():
+            compiled = self._compile(table)
+            self.tables[column] = compiled
+            # Columns can be decoded under either their raw or renamed names
+            if column in self.rename_mapping:
+                self.tables[self.rename_mapping[column]] = compiled
+
+    @classmethod
+    def from_config(cls, extra_tables=None):
+        '''
+        Builds a decoder from the <variable>_dict tables for every variable in
+        config.selected_variables. extra_tables can add lookups that don't live in config.py
+        (e.g. FIPS code -> state abbreviation).
+        '''
+        tables = {}
+        for variable in dict.fromkeys(config.selected_variables):
+            table = getattr(config, f"{variable}_dict", None)
+            if table is not None:
+                tables[variable] = table
+
+        tables.update(extra_tables or {})
+
+        return cls(tables, config.rename_mapping)
+
+    @staticmethod
+    def _compile(table):
+        '''
+        Turns a code table into (normalized code -> category position, categories, ranges),
+        where ranges are (low, high, position of low) rules for the CodeTable's numeric
+        ranges. Compiled CodeTables are cached by content.
+        '''
+        if not isinstance(table, CodeTable):
+            return CodeTableDecoder._compile_items(table.items())
+
+        key = table.content_hash()
+        if key not in _compiled_tables:
+            _compiled_tables[key] = CodeTableDecoder._compile_items(table.explicit_items(),
+                                                                    table.ranges)
+        return _compiled_tables[key]
+
+    @staticmethod
+    def _compile_items(items, ranges=()):
+        items = list(items)
+        categories = list(dict.fromkeys(label for _, label in items))
+        positions = {category: i for i, category in enumerate(categories)}
+
+        # A None code (e.g. None: 'Missing') is the label for missing values, so it's kept
+        # under the None key, which is what normalize_code gives for NaN/None/''
+        lookup = {}
+        for code, label in items:
+            lookup.setdefault(normalize_code(code), positions[label])
+
+        # Each range's numbers go after the other labels, in order
+        range_rules = []
+        for low, high in ranges:
+            range_rules.append((low, high, len(categories)))
+            categories.extend(range(low, high + 1))
+
+        return lookup, pd.Index(categories, dtype=object), tuple(range_rules)
+
+    @staticmethod
+    def _position(lookup, ranges, value):
+        key = normalize_code(value)
+        position = lookup.get(key, -1)
+        if position < 0 and ranges and key is not None and key.lstrip("-").isdigit():
+            number = int(key)
+            for low, high, start in ranges:
+                if low <= number <= high:
+                    return start + number - low
+        return position
+
+    def decode_column(self, series, column=None):
+        '''
+        Decodes a single column. Values that aren't in the table become NaN, same as Series.map;
+        missing values get the table's label for None if it has one (e.g. 'Missing').
+        '''
+        lookup, categories, ranges = self.tables[column if column is not None else series.name]
+
+        codes, uniques = pd.factorize(series)
+        missing = lookup.get(None, -1)
+        unique_positions = np.array(
+            [self._position(lookup, ranges, value) for value in uniques] + [missing],
+            dtype=np.int64)
+
+        # factorize marks missing values with -1, which picks up the trailing missing label above
+        decoded = pd.Categorical.from_codes(
+            unique_positions[codes], categories=categories)
+
+        return pd.Series(decoded, index=series.index, name=series.name)
+
+    def unmapped_values(self, df, columns=None, sample_rows=3):
+        '''
+        Raw values that the code tables don't cover, i.e. the ones decode would quietly turn
+        into NaN, for every column of df with a table (or just the given columns).
+
+        Each column is factorized once and only its distinct values are looked up, so this is
+        one pass over the data however many rows there are. Returns a DataFrame with one row
+        per (column, value): how many rows have it, their share of the column and the index
+        labels of the first sample_rows of them. Missing values aren't counted as unmapped.
+        '''
+        if columns is None:
+            columns = [column for column in df.columns if column in self.tables]
+
+        frames = []
+        for column in columns:
+            lookup, _, ranges = self.tables[column]
+            codes, uniques = pd.factorize(df[column])
+            unmapped = np.array([normalize_code(value) is not None
+                                 and self._position(lookup, ranges, value) < 0
+                                 for value in uniques], dtype=bool)
+            if not unmapped.any():
+                continue
+
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            bad = np.flatnonzero(unmapped)
+            # The first sample_rows rows with each unmapped value: a stable sort of those rows
+            # by value keeps each value's rows in order
+            rows = np.flatnonzero(np.isin(codes, bad))
+            rows = rows[np.argsort(codes[rows], kind="stable")]
+            starts = np.searchsorted(codes[rows], bad)
+            samples = {code: list(df.index[rows[start:start + min(sample_rows, counts[code])]])
+                       for code, start in zip(bad, starts)}
+
+            frames.append(pd.DataFrame({
+                "column": column,
+                "value": np.asarray(uniques, dtype=object)[bad],
+                "count": counts[bad],
+                "share": counts[bad] / len(df) if len(df) else 0.0,
+                "sample_rows": [samples[code] for code in bad],
+            }))
+
+        report = (pd.concat(frames, ignore_index=True) if frames else
+                  pd.DataFrame(columns=["column", "value", "count", "share", "sample_rows"]))
+        return report.sort_values(["column", "count"], ascending=[True, False],
+                                  ignore_index=True)
+
+    def decode(self, df, columns=None):
+        '''
+        Decodes every column of df that has a code table (or just the given columns) and returns
+        a new DataFrame with those columns replaced by Categoricals.
+        '''
+        if columns is None:
+            columns = [column for column in df.columns if column in self.tables]
+
+        decoded = {column: self.decode_column(df[column], column)
+                   for column in columns}
+
+        return df.assign(**decoded)
+
+
+def unmapped_values(df, tables=None, selected_variables=None, sample_rows=3):
+    '''
+    Profiles a raw CEV frame (raw variable names) for values that the code tables don't
+    cover: see CodeTableDecoder.unmapped_values. By default it checks the <variable>_dict
+    table of every variable in config.selected_variables; tables ({variable: table}) and
+    selected_variables can be given instead (e.g. another year's codebook).
+    '''
+    if tables is None:
+        variables = dict.fromkeys(selected_variables or config.selected_variables)
+        tables = {variable: getattr(config, f"{variable}_dict") for variable in variables
+                  if hasattr(config, f"{variable}_dict")}
+    elif selected_variables is not None:
+        tables = {variable: table for variable, table in tables.items()
+                  if variable in selected_variables}
+
+    decoder = CodeTableDecoder(tables)
+    return decoder.unmapped_values(df, [column for column in tables if column in df.columns],
+                                   sample_rows)
+
+
+def format_unmapped(report, max_values=10):
+    '''
+    Readable summary of an unmapped_values report, a line per column with its most common
+    unmapped values.
+    '''
+    lines = []
+    for column, rows in report.groupby("column", sort=True):
+        values = ", ".join(f"{value!r} ({count:,})" for value, count
+                           in zip(rows["value"][:max_values], rows["count"][:max_values]))
+        more = f" and {len(rows) - max_values} more" if len(rows) > max_values else ""
+        lines.append(f"{column}: {values}{more}")
+    return "\n".join(lines)
@@ -0,0 +1,94 @@
+import numpy as np
+
+import config
+from schema import missing_reason_column
+
+
+insufficient_data_reason = "Insufficient Data"
+
+
+def exclusion_summary(total, by_reason):
+    '''
+    Structured exclusion numbers for the UI to format: excluded, total, percent and the
+    excluded count broken down by reason.
+    '''
+    by_reason = {reason: int(count) for reason, count in by_reason.items() if count}
+    excluded = sum(by_reason.values())
+    percent = (excluded / total) * 100 if total else 0.0
+
+    return {"excluded": excluded, "total": int(total), "percent": percent,
+            "by_reason": by_reason}
+
+
+class ExclusionStats:
+    '''
+    Counts excluded respondents (nonresponse, out of universe, etc.) per dashboard variable.
+
+    The exclusion mask for a variable is built once, from the variable's missing-reason
+    column if it has one (numeric variables) or from the variable itself. Counts are cached
+    per (variable, metric), and nothing copies or deduplicates the full frame: excluded
+    respondents are counted from the mask, and for the engagement score the respondents
+    without a score are added from a second mask.
+    '''
+
+    def __init__(self, df, exclude=None):
+        self.df = df
+        self.exclude = list(config.exclude_categories if exclude is None else exclude)
+        self._masks = {}
+        self._counts = {}
+        self._no_score = None
+
+    def reasons(self, column):
+        '''
+        The column holding the nonresponse labels for a variable.
+        '''
+        reason_name = missing_reason_column(column)
+        if reason_name in self.df.columns:
+            return self.df[reason_name]
+        return self.df[column]
+
+    def variable_mask(self, column):
+        '''
+        Boolean array of respondents excluded for this variable (cached).
+        '''
+        if column not in self._masks:
+            self._masks[column] = self.reasons(column).isin(self.exclude).to_numpy()
+        return self._masks[column]
+
+    def no_score_mask(self):
+        '''
+        Boolean array of respondents without an engagement score (cached).
+        '''
+        if self._no_score is None:
+            self._no_score = self.df['political_engagement_score'].isna().to_numpy()
+        return self._no_score
+
+    def counts(self, column, metric_type=None):
+        '''
+        exclusion_summary for a variable; for the engagement score, respondents without a
+        score count as excluded too (under "Insufficient Data").
+        '''
+        key = (column, metric_type == "engagement")
+        if key not in self._counts:
+            mask = self.variable_mask(column)
+            by_reason = self.reasons(column)[mask].value_counts().to_dict()
+
+            if metric_type == "engagement":
+                by_reason[insufficient_data_reason] = int(
+                    np.count_nonzero(self.no_score_mask() & ~mask))
+
+            self._counts[key] = exclusion_summary(len(self.df), by_reason)
+
+        return self._counts[key]
+
+
+def format_exclusion_stats(stats):
+    '''
+    Text version of exclusion_summary for the dashboard.
+    '''
+    breakdown = ", ".join(f"{reason}: {count:,}"
+                          for reason, count in stats["by_reason"].items())
+
+    return (f"Number of responses excluded: {stats['excluded']:,} out of {stats['total']:,}\n\n || "
+            f"Percentage of total responses excluded: {stats['percent']:.1f}%"
+            + (f"\n\n || By reason: {breakdown}" if breakdown else ""))
@@ -0,0 +1,47 @@
+import pandas as pd
+
+
+# Attribution: ChatGPT
+# Asked "how to bin age-related data using pandas for easier bar-graphing", suggested using pd.cut()
+age_bins = [0, 25, 35, 45, 55, 65, 100]
+age_labels = ['18-25', '26-35', '36-45', '46-55', '56-65', '65+']
+
+age_group_dtype = pd.CategoricalDtype(age_labels, ordered=True)
+
+
+def bin_age(age):
+    numeric_age = pd.to_numeric(age, errors='coerce')
+    return pd.cut(numeric_age, bins=age_bins, labels=age_labels).astype(age_group_dtype)
+
+
+# Columns derived from other columns: derived column -> (source column, function, dtype).
+# They're computed once when the data is cleaned or loaded, not on every chart.
+derived_columns = {
+    "Age_Group": ("Age", bin_age, age_group_dtype),
+}
+
+# Dashboard variables that are charted from a derived column (variable -> derived column)
+dashboard_columns = {"Age": "Age_Group"}
+
+
+def add_derived_columns(df):
+    '''
+    Adds every derived column whose source column is in df and that df doesn't have yet.
+    '''
+    new_columns = {name: function(df[source])
+                   for name, (source, function, _) in derived_columns.items()
+                   if source in df.columns and name not in df.columns}
+    return df.assign(**new_columns) if new_columns else df
+
+
+def dashboard_column(df, column):
+    '''
+    The values the dashboard groups by for a variable (e.g. Age_Group instead of Age).
+    Uses the precomputed column when df has it.
+    '''
+    name = dashboard_columns.get(column, column)
+    if name in df.columns:
+        return df[name]
+
+    source, function, _ = derived_columns[name]
+    return function(df[source])
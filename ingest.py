@@ -0,0 +1,64 @@
+from pathlib import Path
+
+import pandas as pd
+
+import config
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+def ingest_raw_file(csv_path, output_path, decoder=None, columns=None, chunksize=100_000):
+    '''
+    Streams a raw CEV/CPS csv into a parquet file, keeping only the columns we use.
+
+    Only columns (default: selected_variables plus the merge keys) are parsed, chunksize
+    rows at a time, so peak memory depends on the chunk size rather than the file size.
+    Column names are lowercased (the CPS files use upper case), merge keys are stored as
+    integers, and if a decoder (decoder.CodeTableDecoder) is given each chunk is decoded
+    before it's appended.
+
+    Returns output_path.
+    '''
+    if pq is None:
+        raise ImportError("ingest_raw_file needs pyarrow to write parquet output")
+
+    wanted = set(dict.fromkeys(columns or config.selected_variables + config.merge_keys))
+    output_path = Path(output_path)
+
+    reader = pd.read_csv(csv_path, usecols=lambda name: name.lower() in wanted,
+                         dtype=str, chunksize=chunksize)
+
+    writer = None
+    try:
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.lower()
+
+            for key in config.merge_keys:
+                if key in chunk.columns:
+                    chunk[key] = pd.to_numeric(chunk[key], errors='coerce').astype("Int64")
+
+            if decoder is not None:
+                chunk = decoder.decode(chunk)
+                # Parquet dictionaries need one value type, so numeric tables (hours, age)
+                # keep their labels as strings; schema.apply_schema turns them back into numbers
+                for name in chunk.columns[chunk.dtypes == "category"]:
+                    chunk[name] = chunk[name].cat.rename_categories(str)
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                # The first chunk fixes the schema; later chunks are cast to it (e.g. a
+                # column that happens to be all-missing in one chunk)
+                writer = pq.ParquetWriter(output_path, table.schema)
+            else:
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return output_path
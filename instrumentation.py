@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+try:
+    page_size = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    page_size = 4096
+
+
+def memory_usage():
+    '''
+    Resident memory of this process in bytes (None where /proc isn't available, e.g. macOS).
+    '''
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * page_size
+
+
+class StageMetrics:
+    '''
+    Rolling timings for named stages of the dashboard (cube load, aggregation, spec build,
+    exclusion stats, ...). Each stage keeps its last window measurements of duration and
+    resident-memory change, plus a running count, and summary() gives the p50/p95/p99
+    latencies over the window.
+
+    Stages should be synchronous blocks of work. Timing around an await also counts the
+    time spent waiting on other requests.
+    '''
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.durations = {}
+        self.memory_deltas = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+        # Timed blocks running right now, by thread, each with a flag for whether another
+        # thread's block overlapped it
+        self.active = {}
+
+    def record(self, stage, seconds, memory_delta=None):
+        with self.lock:
+            if stage not in self.durations:
+                self.durations[stage] = deque(maxlen=self.window)
+                self.memory_deltas[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+            self.durations[stage].append(seconds)
+            if memory_delta is not None:
+                self.memory_deltas[stage].append(memory_delta)
+            self.counts[stage] += 1
+
+    @contextmanager
+    def timed(self, stage):
+        '''
+        with metrics.timed("stage"): ... records how long the block took and how much the
+        process's resident memory changed.
+
+        Nothing is recorded if the block raises (a cancelled or failed stage isn't a latency
+        sample). Resident memory is process-wide, so the memory change is only kept when no
+        other thread was inside a timed block at the same time.
+        '''
+        thread = threading.get_ident()
+        block = {"overlapped": False}
+        with self.lock:
+            others = [blocks for ident, blocks in self.active.items() if ident != thread]
+            if others:
+                block["overlapped"] = True
+                for blocks in others:
+                    for other in blocks:
+                        other["overlapped"] = True
+            self.active.setdefault(thread, []).append(block)
+
+        memory_before = memory_usage()
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self._finish(thread, block)
+            raise
+        seconds = time.perf_counter() - start
+        memory_after = memory_usage()
+        self._finish(thread, block)
+
+        if block["overlapped"] or memory_before is None or memory_after is None:
+            memory_delta = None
+        else:
+            memory_delta = memory_after - memory_before
+        self.record(stage, seconds, memory_delta)
+
+    def _finish(self, thread, block):
+        with self.lock:
+            blocks = self.active[thread]
+            # By identity, nested blocks on one thread can look alike
+            del blocks[next(i for i, other in enumerate(blocks) if other is block)]
+            if not blocks:
+                del self.active[thread]
+
+    def summary(self):
+        '''
+        One row per stage: calls, p50/p95/p99/max latency in milliseconds over the window and
+        the mean memory change in MB.
+        '''
+        with self.lock:
+            stages = {stage: (np.array(durations), np.array(self.memory_deltas[stage]),
+                              self.counts[stage])
+                      for stage, durations in self.durations.items()}
+
+        rows = []
+        for stage, (durations, memory_deltas, count) in sorted(stages.items()):
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99]) * 1000
+            rows.append({
+                "stage": stage,
+                "calls": count,
+                "p50_ms": p50,
+                "p95_ms": p95,
+                "p99_ms": p99,
+                "max_ms": durations.max() * 1000,
+                "mean_memory_mb": (memory_deltas.mean() / 1e6 if len(memory_deltas)
+                                   else np.nan),
+            })
+
+        return pd.DataFrame(rows, columns=["stage", "calls", "p50_ms", "p95_ms", "p99_ms",
+                                           "max_ms", "mean_memory_mb"])
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+            self.memory_deltas.clear()
+            self.counts.clear()
+
+
+# Shared by everything in the process (app, chart rendering, cube loading)
+metrics = StageMetrics()
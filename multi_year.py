@@ -0,0 +1,165 @@
+import json
+import shutil
+from pathlib import Path
+
+import pandas as pd
+
+import config
+from aggregates import build_aggregate_cube, build_pair_index
+from schema import apply_schema, wanted_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    ds = None
+    pq = None
+
+
+# Layout of a multi-year dataset:
+#   <root>/parquet/year=2021/state=IL/<part>.parquet   cleaned rows, partitioned by year and state
+#   <root>/cubes/cube-2021.json                          the dashboard aggregate cube for each year
+#   <root>/cubes/pairs-2021.json                         and its two-way pair index
+state_partition = "state"
+
+
+def year_codebook(year):
+    '''
+    The variables and code tables for one CEV year: config.py's 2021 codebook with that year's
+    year_overrides applied. Returns a dict with selected_variables, rename_mapping and tables
+    (raw variable -> code table), the pieces the cleaning pipeline needs.
+    '''
+    if year not in config.cev_years:
+        raise ValueError(f"No codebook for {year}; add it to cev_years in config.py")
+    if year not in config.year_overrides:
+        raise ValueError(f"The {year} codebook hasn't been checked against 2021's yet; add its "
+                         f"differences (or {{}} if there are none) to year_overrides in config.py")
+
+    overrides = config.year_overrides[year]
+    renamed = overrides.get("rename_mapping", {})
+    drop = set(overrides.get("drop", []))
+    rename_mapping = {**config.rename_mapping, **renamed}
+
+    # A column that comes from a differently named variable this year replaces the 2021 one
+    replaced_columns = set(renamed.values())
+    selected_variables = [
+        variable for variable in dict.fromkeys(config.selected_variables)
+        if variable not in drop and (variable in renamed or
+                                     config.rename_mapping[variable] not in replaced_columns)
+    ] + [variable for variable in renamed if variable not in config.selected_variables]
+
+    tables = {variable: getattr(config, f"{variable}_dict")
+              for variable in selected_variables if hasattr(config, f"{variable}_dict")}
+    tables.update(overrides.get("tables", {}))
+
+    return {"year": year, "selected_variables": selected_variables,
+            "rename_mapping": rename_mapping, "tables": tables}
+
+
+def parquet_root(root):
+    return Path(root) / "parquet"
+
+
+def year_cube_path(root, year):
+    return Path(root) / "cubes" / f"cube-{year}.json"
+
+
+def year_pairs_path(root, year):
+    return Path(root) / "cubes" / f"pairs-{year}.json"
+
+
+def write_year(df, year, root, state_column="US State"):
+    '''
+    Replaces year's partition of the dataset at root with df (cleaned, in the schema dtypes),
+    split into one directory per state, and writes the year's aggregate cube and pair index.
+    '''
+    if pq is None:
+        raise ImportError("write_year needs pyarrow to write the partitioned dataset")
+
+    year_path = parquet_root(root) / f"year={year}"
+    if year_path.exists():
+        shutil.rmtree(year_path)
+
+    partitioned = df.assign(**{state_partition: df[state_column].astype(str)})
+    table = pa.Table.from_pandas(partitioned, preserve_index=False)
+    pq.write_to_dataset(table, year_path, partition_cols=[state_partition])
+
+    cube = build_aggregate_cube(df)
+    path = year_cube_path(root, year)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"year": year, "rows": cube.to_dict(orient="records")}, f)
+
+    with open(year_pairs_path(root, year), "w") as f:
+        json.dump({"year": year, **build_pair_index(df).to_dict(orient="split", index=False)}, f)
+
+    return year_path
+
+
+def available_years(root):
+    '''
+    Years with a cube at root, oldest first.
+    '''
+    return sorted(int(path.stem.split("-")[1])
+                  for path in (Path(root) / "cubes").glob("cube-*.json"))
+
+
+def load_years(root, years=None, states=None, columns=None):
+    '''
+    Cleaned rows for the given years and states (default: all of them), with a year column.
+    Only the selected years' directories are opened, and the state filter is applied to the
+    state=... partition directories, so files for other years and states are never read.
+    '''
+    if years is None:
+        years = sorted(int(path.name.split("=")[1])
+                       for path in parquet_root(root).glob("year=*"))
+
+    frames = []
+    for year in years:
+        dataset = ds.dataset(parquet_root(root) / f"year={year}", format="parquet",
+                             partitioning="hive")
+
+        expression = None
+        if states is not None:
+            expression = ds.field(state_partition).isin([str(state) for state in states])
+
+        names = dataset.schema.names
+        if columns is not None:
+            wanted = wanted_columns(columns)
+            names = [c for c in names if c in wanted]
+
+        frame = dataset.to_table(columns=names, filter=expression).to_pandas()
+        frames.append(frame.drop(columns=state_partition, errors="ignore").assign(year=year))
+
+    # Years can have different categories (or columns), so the schema is applied after stacking
+    return apply_schema(pd.concat(frames, ignore_index=True))
+
+
+def load_year_cubes(root, years):
+    '''
+    The aggregate cubes for years, stacked with a year column. Only those years' cube files
+    are read.
+    '''
+    cubes = []
+    for year in years:
+        with open(year_cube_path(root, year)) as f:
+            cubes.append(pd.DataFrame(json.load(f)["rows"]).assign(year=year))
+    return pd.concat(cubes, ignore_index=True)
+
+
+def load_year_pairs(root, years):
+    '''
+    The pair indexes for years, stacked with a year column, or None if any of them hasn't
+    been written (datasets built before there was a pair index).
+    '''
+    indexes = []
+    for year in years:
+        path = year_pairs_path(root, year)
+        if not path.exists():
+            return None
+        with open(path) as f:
+            saved = json.load(f)
+        indexes.append(pd.DataFrame(saved["data"], columns=saved["columns"]).assign(year=year))
+    return pd.concat(indexes, ignore_index=True)
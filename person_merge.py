@@ -0,0 +1,66 @@
+import pandas as pd
+
+import config
+
+
+def _person_frame(df, keys, columns):
+    '''
+    The key columns (as nullable integers) plus whichever of columns the frame has.
+    Rows missing any key can't be matched to a person, so they're dropped.
+    '''
+    frame = df[keys + [c for c in columns if c in df.columns]].copy()
+    for key in keys:
+        frame[key] = pd.to_numeric(frame[key], errors='coerce').astype("Int64")
+
+    has_keys = frame[keys].notna().all(axis=1)
+    return frame[has_keys], int((~has_keys).sum())
+
+
+def merge_person_files(cev, cps, keys=None, columns=None,
+                       how="outer", validate="one_to_one"):
+    '''
+    Joins the CEV file and the CPS September supplement on the person identifiers
+    (household IDs + line number) instead of on every column the two files share.
+
+    Only the key columns (default: merge_keys) and columns (default: selected_variables)
+    are kept from each side.
+    A variable that's in both files becomes a single column: the CEV value, filled in from
+    the CPS file where the CEV is missing. validate is passed to pd.merge, so by default a
+    person showing up twice on either side raises a MergeError instead of silently
+    multiplying rows.
+
+    Returns (merged, counts), where counts has the row counts before and after the join.
+    '''
+    # Looked up from config when called, so a reloaded config.py is picked up
+    keys = list(config.merge_keys if keys is None else keys)
+    columns = config.selected_variables if columns is None else columns
+    columns = [c for c in dict.fromkeys(columns) if c not in keys]
+    left, left_missing = _person_frame(cev, keys, columns)
+    right, right_missing = _person_frame(cps, keys, columns)
+
+    merged = left.merge(right, on=keys, how=how, suffixes=("", "_cps"),
+                        validate=validate, indicator=True)
+
+    for column in columns:
+        other = f"{column}_cps"
+        if other not in merged.columns:
+            continue
+        if merged[column].dtype != merged[other].dtype:
+            merged[column] = merged[column].astype(object)
+            merged[other] = merged[other].astype(object)
+        merged[column] = merged[column].where(merged[column].notna(), merged[other])
+        merged = merged.drop(columns=other)
+
+    matches = merged["_merge"].value_counts()
+    counts = {
+        "cev_rows": len(cev),
+        "cps_rows": len(cps),
+        "cev_rows_missing_keys": left_missing,
+        "cps_rows_missing_keys": right_missing,
+        "matched": int(matches.get("both", 0)),
+        "cev_only": int(matches.get("left_only", 0)),
+        "cps_only": int(matches.get("right_only", 0)),
+        "merged_rows": len(merged),
+    }
+
+    return merged.drop(columns="_merge"), counts
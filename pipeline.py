@@ -0,0 +1,227 @@
+import hashlib
+import importlib
+from pathlib import Path
+
+import pandas as pd
+
+import config
+import features
+import schema
+from decoder import CodeTableDecoder, decode_version, format_unmapped
+from code_tables import codebook_hash
+from ingest import ingest_raw_file
+from person_merge import merge_person_files
+from data_cache import file_hash, write_cleaned_data
+from aggregates import write_aggregate_cube, write_pair_index
+from data_store import build_store
+import multi_year
+
+
+stage_names = ["ingest_cev", "ingest_cps", "merge", "select", "decode", "score", "export"]
+
+
+def content_hash(*parts):
+    '''
+    Short, stable hash of the repr of everything a stage depends on.
+    '''
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode())
+    return digest.hexdigest()[:16]
+
+
+def code_tables():
+    '''
+    The <variable>_dict table for every selected variable (variable -> table), which is
+    what decode uses. The decode key comes from their codebook_hash, so editing any one of
+    them changes it, and reloading config.py doesn't.
+    '''
+    return {variable: getattr(config, f"{variable}_dict")
+            for variable in dict.fromkeys(config.selected_variables)
+            if hasattr(config, f"{variable}_dict")}
+
+
+class CleaningPipeline:
+    '''
+    The CEV/CPS cleaning steps from the notebook as named stages:
+
+        ingest_cev / ingest_cps -> merge -> select -> decode -> score -> export
+
+    Each stage's output is cached as parquet in cache_dir, under a key made from the key of
+    the stage before it plus the inputs the stage itself uses (the raw file hash for
+    ingestion, rename_mapping for select, the code tables for decode, the engagement
+    weights for score). Editing one mapping dict therefore only reruns decode and the
+    stages after it.
+
+    With a year, that year's codebook (multi_year.year_codebook) and the schema built from it
+    are used instead of the 2021 ones (a year whose codebook isn't in config.py raises), and
+    with a dataset_root the export also writes the year into the partitioned multi-year
+    dataset there.
+
+    Right after ingestion, the raw files are checked for values the code tables don't cover
+    (decoder.CodeTableDecoder.unmapped_values), which decode would turn into NaN. unmapped
+    says what to do about them: "warn" (print them), "raise" (stop before merging and
+    decoding) or "ignore". The report is kept as self.unmapped either way.
+    '''
+
+    def __init__(self, cev_path, cps_path, output_path, cache_dir="data/pipeline_cache",
+                 extra_tables=None, verbose=True, year=None, dataset_root=None,
+                 unmapped="warn"):
+        self.cev_path = Path(cev_path)
+        self.cps_path = Path(cps_path)
+        self.output_path = Path(output_path)
+        self.cache_dir = Path(cache_dir)
+        self.extra_tables = extra_tables or {}
+        self.verbose = verbose
+        self.year = year
+        self.dataset_root = dataset_root
+        self.unmapped_action = unmapped
+        self.unmapped = None
+        self.keys = {}
+
+    def codebook(self):
+        '''
+        selected_variables, rename_mapping and code tables for this run's year.
+        '''
+        if self.year is not None:
+            return multi_year.year_codebook(self.year)
+        return {"year": None, "selected_variables": config.selected_variables,
+                "rename_mapping": config.rename_mapping, "tables": code_tables()}
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def cached(self, name, key, compute):
+        '''
+        Returns the cached output for (name, key), or runs compute and caches its result.
+        '''
+        self.keys[name] = key
+        path = self.cache_dir / f"{name}-{key}.parquet"
+        if path.exists():
+            self.log(f"{name}: using cache")
+            return pd.read_parquet(path)
+
+        self.log(f"{name}: running")
+        df = compute()
+        df.to_parquet(path, index=False)
+        return df
+
+    def ingest(self, name, csv_path, selected_variables):
+        key = content_hash(file_hash(csv_path), selected_variables, config.merge_keys)
+        path = self.cache_dir / f"{name}-{key}.parquet"
+        self.keys[name] = key
+        if path.exists():
+            self.log(f"{name}: using cache")
+        else:
+            self.log(f"{name}: running")
+            ingest_raw_file(csv_path, path,
+                            columns=list(selected_variables) + config.merge_keys)
+        return pd.read_parquet(path)
+
+    def check_codes(self, frames, tables):
+        '''
+        Profiles the ingested raw frames ({name: frame}) for values their code tables don't
+        cover, and warns or raises depending on unmapped.
+        '''
+        if self.unmapped_action == "ignore":
+            return
+
+        decoder = CodeTableDecoder({**tables, **self.extra_tables})
+        self.unmapped = pd.concat(
+            [decoder.unmapped_values(frame, [c for c in frame.columns if c in decoder.tables])
+             .assign(file=name) for name, frame in frames.items()], ignore_index=True)
+        if self.unmapped.empty:
+            self.log("check_codes: every value is in the code tables")
+            return
+
+        message = ("values that aren't in the code tables (they would decode to NaN):\n"
+                   + format_unmapped(self.unmapped))
+        if self.unmapped_action == "raise":
+            raise ValueError(f"Found {message}\nAdd them to config.py (or pass unmapped='warn')")
+        print(f"check_codes: found {message}")
+
+    def run(self, reload_config=True):
+        '''
+        Runs (or reuses) every stage and returns the cleaned, typed dataframe.
+        reload_config picks up edits to config.py without restarting the kernel.
+        '''
+        if reload_config:
+            importlib.reload(config)
+            importlib.reload(features)
+            importlib.reload(schema)
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        codebook = self.codebook()
+        selected_variables = codebook["selected_variables"]
+        rename_mapping = codebook["rename_mapping"]
+
+        cev = self.ingest("ingest_cev", self.cev_path, selected_variables)
+        cps = self.ingest("ingest_cps", self.cps_path, selected_variables)
+        self.check_codes({"cev": cev, "cps": cps}, codebook["tables"])
+
+        def merge():
+            merged, counts = merge_person_files(
+                cev, cps, keys=config.merge_keys, columns=selected_variables)
+            self.log(f"merge: {counts}")
+            return merged
+
+        merged = self.cached("merge", content_hash(
+            self.keys["ingest_cev"], self.keys["ingest_cps"],
+            config.merge_keys, selected_variables), merge)
+
+        # A variable missing from this year's files comes out as an empty column
+        selected = self.cached("select", content_hash(
+            self.keys["merge"], rename_mapping),
+            lambda: merged.reindex(columns=list(dict.fromkeys(selected_variables)))
+            .rename(columns=rename_mapping))
+
+        # Decoded columns go straight into this year's schema types, which parquet can store
+        decoder = CodeTableDecoder({**codebook["tables"], **self.extra_tables}, rename_mapping)
+        dtypes, numeric_columns = schema.build_schema(codebook)
+        decoded = self.cached("decode", content_hash(
+            self.keys["select"], codebook_hash({**codebook["tables"], **self.extra_tables}),
+            dtypes, numeric_columns, decode_version),
+            lambda: schema.apply_schema(decoder.decode(selected), dtypes, numeric_columns))
+
+        # Derived columns (e.g. Age_Group) are added here once, so nothing downstream bins ages
+        scored = self.cached("score", content_hash(
+            self.keys["decode"], config.engagement_weights,
+            config.engagement_component_scores, features.age_bins, features.age_labels),
+            lambda: features.add_derived_columns(config.add_engagement_score(decoded.copy())))
+
+        self.export(scored)
+
+        return scored
+
+    def export(self, df):
+        '''
+        Writes the csv, parquet cache, aggregate cube, pair index and shared store for the
+        app, unless they were already written from this exact score output.
+        '''
+        key = content_hash(self.keys["score"], str(self.output_path), self.year,
+                           str(self.dataset_root))
+        self.keys["export"] = key
+        marker = self.cache_dir / f"export-{key}.done"
+        if marker.exists() and self.output_path.exists():
+            self.log("export: up to date")
+            return
+
+        self.log(f"export: writing {self.output_path}")
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        # The csv is hashed once here; the files written next to it are tagged with that hash
+        source_hash = write_cleaned_data(df, self.output_path)
+        write_aggregate_cube(df, self.output_path, source_hash)
+        write_pair_index(df, self.output_path, source_hash)
+        build_store(self.output_path, source_hash)
+        if self.dataset_root is not None and self.year is not None:
+            self.log(f"export: writing {self.year} to {self.dataset_root}")
+            multi_year.write_year(df, self.year, self.dataset_root)
+        marker.touch()
+
+
+def run_pipeline(cev_path, cps_path, output_path, **kwargs):
+    '''
+    Convenience wrapper: CleaningPipeline(...).run()
+    '''
+    return CleaningPipeline(cev_path, cps_path, output_path, **kwargs).run()
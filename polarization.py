@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+import config
+
+
+# Labels from the V201228 (party) and V201200 (ideology) crosswalks in the notebook
+party_people = ["Democrat", "Republican"]
+
+conservatives = ["Slightly Conservative",
+                 "Conservative",
+                 "Extremely Conservative"]
+
+liberals = ["Extremely Liberal",
+            "Liberal", "Slightly Liberal"]
+
+party_column = "Party_Affiliation_(V201228)"
+ideology_column = "Ideology_(V201200)"
+state_column = "US State 2"
+
+
+def flag_partisans(df):
+    '''
+    Vectorized version of find_share_nation: returns df with two new 0/1 columns,
+        - 'Party_Count': respondent identifies as a Democrat or Republican
+        - 'Outliers': a Democrat with a conservative ideology or a Republican with a liberal one
+
+    Note: the loop versions compared the party to "Democratic", which never matches the
+    crosswalk's "Democrat" label, so conservative Democrats were never counted as outliers.
+    '''
+    party = df[party_column]
+    ideology = df[ideology_column]
+
+    outliers = (((party == "Democrat") & ideology.isin(conservatives)) |
+                ((party == "Republican") & ideology.isin(liberals)))
+
+    return df.assign(Party_Count=party.isin(party_people).astype(int),
+                     Outliers=outliers.astype(int))
+
+
+def polar_table(df):
+    '''
+    Summary table of polarization by state (one groupby over all states): each state's sum
+    of outliers and partisans, and Percent_Outliers = the state's outliers as a share of all
+    partisans in the data (same as the notebook's polar_table).
+    '''
+    table = (flag_partisans(df)
+             .groupby(state_column)[["Outliers", "Party_Count"]]
+             .sum()
+             .reset_index())
+    table["Percent_Outliers"] = table["Outliers"] / table["Party_Count"].sum()
+    return table
+
+
+def polar_table_by_party(df):
+    '''
+    seek_polar for every state at once: outliers and partisans by state and party, with
+    Percent_Outliers = outliers as a share of the state's partisans.
+    '''
+    table = (flag_partisans(df)
+             .groupby([state_column, party_column])[["Outliers", "Party_Count"]]
+             .sum()
+             .reset_index())
+    state_partisans = table.groupby(state_column)["Party_Count"].transform("sum")
+    table["Percent_Outliers"] = table["Outliers"] / state_partisans
+    return table
+
+
+def seek_polar(df, state):
+    '''
+    Aggregates polarization data for a specific state, calculating the share of ideological outliers within party-affiliated populations.
+    '''
+    table = polar_table_by_party(df[df[state_column] == state])
+    return table.drop(columns=state_column)
+
+
+def apply_crosswalks(df, crosswalks=None):
+    '''
+    Adds the crosswalk columns (labels/positions for V201200, V201228, V201206, V201207, see
+    anes_crosswalks in config.py) to df in place, one question at a time with an index lookup
+    instead of a merge. Rows with a code that isn't in a crosswalk are kept (with NaN in the
+    new columns) rather than dropped.
+
+    Returns (df, unmapped), where unmapped maps each question to {code: number of rows} for
+    the codes its crosswalk doesn't cover.
+    '''
+    crosswalks = config.anes_crosswalks if crosswalks is None else crosswalks
+    unmapped = {}
+
+    for question, columns in crosswalks.items():
+        codes = pd.to_numeric(df[question], errors='coerce')
+        # All of a question's columns share its codes, so find the positions once
+        known_codes = pd.Index(list(dict.fromkeys(
+            code for table in columns.values() for code in table)))
+        positions = known_codes.get_indexer(codes)
+        is_mapped = positions >= 0
+
+        for column, table in columns.items():
+            values = pd.Series([table.get(code) for code in known_codes], dtype=object)
+            values = values.infer_objects().to_numpy()
+            df[column] = pd.Series(values[positions], index=df.index).where(is_mapped)
+
+        unmapped_counts = df.loc[~is_mapped, question].value_counts(dropna=False)
+        if len(unmapped_counts):
+            unmapped[question] = unmapped_counts.to_dict()
+
+    return df, unmapped
+
+
+# Spread of extreme views (V201206/V201207)
+extreme_groups = {"Extremely Liberal": "Liberal", "Extremely Conservative": "Conservative"}
+positioning_columns = {"Dem": "Dem_Positioning(V201206)", "Repub": "Repub_Positioning(V201207)"}
+party_ideology_columns = ["Dem_Ideology_(V201206)", "Repub_Ideology_(V201207)"]
+position_values = np.arange(-3, 4)
+
+
+class SpreadStats:
+    '''
+    Running sufficient statistics for the spread measure: for every state, extreme group
+    (Liberal/Conservative) and party question, how many respondents placed the party at each
+    position from -3 to 3. Means, spreads and bootstrap intervals all come from these counts,
+    so a new ANES wave or subset can be folded in with update() (or two SpreadStats added
+    together) without keeping or re-merging any row-level data.
+
+    counts has shape (states, groups, questions, positions).
+    '''
+
+    groups = ["Liberal", "Conservative"]
+    questions = list(positioning_columns)
+
+    def __init__(self, states=None, counts=None):
+        self.states = pd.Index([] if states is None else states, name=state_column)
+        if counts is None:
+            counts = np.zeros((len(self.states), len(self.groups), len(self.questions),
+                               len(position_values)), dtype=np.int64)
+        self.counts = counts
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls().update(df)
+
+    def update(self, df):
+        '''
+        Adds the extreme respondents in df (the same filters as the notebook: extremely
+        liberal/conservative self-placement, and no "Don't Know"/"Refused" for either party).
+        Returns self.
+        '''
+        group = df[ideology_column].map(extreme_groups)
+        keep = group.notna() & df[state_column].notna()
+        for column in party_ideology_columns:
+            keep &= ~df[column].isin(["Don't Know", "Refused"])
+        positions = df.loc[keep, list(positioning_columns.values())].apply(
+            pd.to_numeric, errors='coerce')
+        # Codes missing from a crosswalk used to drop the row in the merge, so they still do
+        keep = positions.notna().all(axis=1)
+        rows = df.loc[positions.index[keep]]
+        positions = positions[keep].to_numpy(dtype=np.int64) - position_values[0]
+
+        states = self.states.union(pd.Index(rows[state_column].unique()), sort=True)
+        if not states.equals(self.states):
+            counts = np.zeros((len(states),) + self.counts.shape[1:], dtype=np.int64)
+            counts[states.get_indexer(self.states)] = self.counts
+            self.states, self.counts = states.rename(state_column), counts
+
+        state_codes = self.states.get_indexer(rows[state_column])
+        group_codes = pd.Index(self.groups).get_indexer(group[rows.index])
+        for question in range(len(self.questions)):
+            np.add.at(self.counts, (state_codes, group_codes, question, positions[:, question]), 1)
+        return self
+
+    def __add__(self, other):
+        states = self.states.union(other.states, sort=True)
+        counts = np.zeros((len(states),) + self.counts.shape[1:], dtype=np.int64)
+        counts[states.get_indexer(self.states)] += self.counts
+        counts[states.get_indexer(other.states)] += other.counts
+        return SpreadStats(states, counts)
+
+    def means(self, counts=None):
+        '''
+        Average position per (state, group, question); NaN where a group has no respondents.
+        counts can be bootstrap draws with extra leading axes.
+        '''
+        counts = self.counts if counts is None else counts
+        totals = counts.sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (counts * position_values).sum(axis=-1) / totals
+
+    def table(self):
+        '''
+        One row per state: the same columns as the notebook's pivot_position
+        (Dem_Position_C, Dem_Position_L, Repub_Position_C, Repub_Position_L, Spread_Dem,
+        Spread_Repub) plus the number of respondents in each extreme group.
+        '''
+        means = self.means()
+        table = pd.DataFrame(index=self.states)
+        for q, question in enumerate(self.questions):
+            for g, group in enumerate(self.groups):
+                table[f"{question}_Position_{group[0]}"] = means[:, g, q]
+        for question in self.questions:
+            table[f"Spread_{question}"] = (table[f"{question}_Position_C"]
+                                           - table[f"{question}_Position_L"]).abs()
+        totals = self.counts[:, :, 0].sum(axis=-1)
+        for g, group in enumerate(self.groups):
+            table[f"N_{group[0]}"] = totals[:, g]
+        return table.reset_index()
+
+    def bootstrap(self, n_boot=1000, ci=0.95, seed=None):
+        '''
+        Percentile bootstrap intervals for Spread_Dem and Spread_Repub. Resampling a group's
+        respondents with replacement is a multinomial draw over its position counts, so the
+        draws come straight from the counts (all states at once) instead of from rows.
+        '''
+        rng = np.random.default_rng(seed)
+        totals = self.counts.sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            shares = np.nan_to_num(self.counts / totals[..., None])
+        # Empty groups get a dummy distribution; their means are NaN anyway (total 0)
+        shares[totals == 0, 0] = 1
+        draws = rng.multinomial(totals, shares, size=(n_boot,) + totals.shape)
+        means = self.means(draws)
+        spreads = np.abs(means[:, :, 1] - means[:, :, 0])
+
+        alpha = (1 - ci) / 2
+        low, high = np.nanquantile(spreads, [alpha, 1 - alpha], axis=0)
+        table = self.table()[[state_column] + [f"Spread_{q}" for q in self.questions]]
+        for q, question in enumerate(self.questions):
+            table[f"Spread_{question}_Low"] = low[:, q]
+            table[f"Spread_{question}_High"] = high[:, q]
+        return table
@@ -0,0 +1,470 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+import config
+import schema
+from aggregates import (cube_metric, cube_exclusion_stats, build_pair_index, pair_metric,
+                        pair_columns)
+from exclusions import exclusion_summary, insufficient_data_reason
+from features import dashboard_columns, derived_columns, dashboard_column
+from schema import missing_reason_column
+from survey_weights import ReplicateWeights, metric_values, replicate_ratio
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+    pc = None
+    ds = None
+
+
+# Every backend answers the dashboard's questions for (group_column, metric, exclusions):
+#   metric(...)          -> category, Metric_Value (plus Lower/Upper if weighted), in axis order
+#   exclusion_stats(...) -> exclusions.exclusion_summary
+#   pair_metric(row_column, column_column, metric, exclusions)
+#                        -> row_category, column_category, count, Metric_Value (the heatmap)
+# CubeBackend reads the precomputed cube, PandasBackend a dataframe in memory, and
+# ArrowBackend scans parquet files in batches, so the data never has to fit in memory.
+# exclusions=None means config.exclude_categories, looked up at query time so a reloaded
+# config.py is picked up.
+
+
+def query_exclusions(exclusions):
+    return list(config.exclude_categories if exclusions is None else exclusions)
+
+
+def category_order(column, categories):
+    '''
+    Sorts categories the way the chart axis shows them: in the schema's category order for
+    categorical variables (answers in code order), otherwise by value.
+    '''
+    dtype = schema.cev_dtypes.get(dashboard_columns.get(column, column))
+    if isinstance(dtype, pd.CategoricalDtype) and dtype.categories is not None:
+        position = {category: i for i, category in enumerate(dtype.categories)}
+        return sorted(categories, key=lambda c: (position.get(c, len(position)), str(c)))
+    return sorted(categories)
+
+
+class MetricTotals:
+    '''
+    Running per-category sums for one (group_column, metric, exclusions) query, which chunks
+    of rows are added to one at a time: row counts, numerator/denominator sums and, if
+    weighted, the (161-column) weighted numerator/denominator totals.
+    '''
+
+    def __init__(self, column, metric_type, exclusions, weighted=False):
+        self.column = column
+        self.metric_type = metric_type
+        self.exclusions = query_exclusions(exclusions)
+        self.weighted = weighted
+        self.sums = {}
+
+    def add(self, df):
+        values = dashboard_column(df, self.column)
+        reasons = df[missing_reason_column(self.column)] if missing_reason_column(
+            self.column) in df.columns else df[self.column]
+        keep = values.notna() & ~reasons.isin(self.exclusions)
+
+        codes, categories = pd.factorize(values[keep])
+        numerator, denominator = metric_values(df[keep], self.metric_type)
+        n_groups = len(categories)
+
+        parts = [np.bincount(codes, minlength=n_groups).astype(float),
+                 np.bincount(codes, weights=numerator, minlength=n_groups),
+                 np.bincount(codes, weights=denominator, minlength=n_groups)]
+        if self.weighted:
+            weights = ReplicateWeights(df[keep])
+            parts += [weights.totals(codes, n_groups, numerator),
+                      weights.totals(codes, n_groups, denominator)]
+
+        for i, category in enumerate(categories):
+            self.add_group(category, [part[i] for part in parts])
+
+    def add_group(self, category, group):
+        '''
+        Adds one category's sums (row count, numerator, denominator and, if weighted, the
+        weighted totals), e.g. from a backend that does the grouping itself.
+        '''
+        if category in self.sums:
+            self.sums[category] = [total + value
+                                   for total, value in zip(self.sums[category], group)]
+        else:
+            self.sums[category] = group
+
+    def result(self):
+        categories = category_order(self.column, list(self.sums))
+        scale = 100 if self.metric_type == "volunteer" else 1
+
+        if self.weighted:
+            if not categories:
+                return pd.DataFrame(columns=["category", "Metric_Value", "Lower", "Upper"])
+            top = np.array([self.sums[c][3] for c in categories])
+            bottom = np.array([self.sums[c][4] for c in categories])
+            estimates, standard_errors = replicate_ratio(top, bottom)
+            metric_value = estimates * scale
+            margin = 1.96 * standard_errors * scale
+            return pd.DataFrame({"category": categories, "Metric_Value": metric_value,
+                                 "Lower": metric_value - margin,
+                                 "Upper": metric_value + margin})
+
+        numerator = np.array([self.sums[c][1] for c in categories])
+        denominator = np.array([self.sums[c][2] for c in categories])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            metric_value = numerator / np.where(denominator == 0, np.nan, denominator) * scale
+        return pd.DataFrame({"category": categories, "Metric_Value": metric_value})
+
+
+class ExclusionTotals:
+    '''
+    Running counts for exclusion_stats: total rows, excluded rows by reason and (for the
+    engagement score) included rows without a score.
+    '''
+
+    def __init__(self, column, metric_type, exclusions):
+        self.column = column
+        self.metric_type = metric_type
+        self.exclusions = query_exclusions(exclusions)
+        self.total = 0
+        self.by_reason = {}
+
+    def add(self, df):
+        reason_name = missing_reason_column(self.column)
+        reasons = df[reason_name] if reason_name in df.columns else df[self.column]
+        excluded = reasons.isin(self.exclusions)
+
+        self.total += len(df)
+        for reason, count in reasons[excluded].value_counts().items():
+            self.by_reason[reason] = self.by_reason.get(reason, 0) + int(count)
+
+        if self.metric_type == "engagement":
+            no_score = df['political_engagement_score'].isna() & ~excluded
+            self.by_reason[insufficient_data_reason] = (
+                self.by_reason.get(insufficient_data_reason, 0) + int(no_score.sum()))
+
+    def result(self):
+        return exclusion_summary(self.total, self.by_reason)
+
+
+def query_columns(column, metric_type, weighted=False):
+    '''
+    The data columns a query needs (before missing-reason/derived columns are added).
+    '''
+    columns = [column, "Volunteered_Past_Year" if metric_type == "volunteer"
+               else "political_engagement_score"]
+    if weighted:
+        columns += [config.weight_column] + config.replicate_weight_columns
+    return columns
+
+
+def dashboard_query_columns(group_columns=None):
+    '''
+    Every data column the dashboard's queries can read, for the group columns
+    (variable_mapping's by default), both metrics and weighted queries.
+    '''
+    group_columns = list(config.variable_mapping) if group_columns is None else group_columns
+    return list(dict.fromkeys(column for group_column in group_columns
+                              for metric_type in ("volunteer", "engagement")
+                              for column in query_columns(group_column, metric_type,
+                                                          weighted=True)))
+
+
+class PandasBackend:
+    '''
+    Queries a cleaned dataframe that's already in memory.
+    '''
+
+    def __init__(self, df):
+        self.df = df
+
+    def metric(self, group_column, metric_type, exclusions=None, weighted=False):
+        totals = MetricTotals(group_column, metric_type, exclusions, weighted)
+        totals.add(self.df)
+        return totals.result()
+
+    def exclusion_stats(self, group_column, metric_type, exclusions=None):
+        totals = ExclusionTotals(group_column, metric_type, exclusions)
+        totals.add(self.df)
+        return totals.result()
+
+    def pair_metric(self, row_column, column_column, metric_type, exclusions=None):
+        index = build_pair_index(self.df, [row_column, column_column], exclusions)
+        return pair_metric(index, row_column, column_column, metric_type)
+
+
+class ArrowBackend:
+    '''
+    Queries cleaned parquet data (the parquet cache next to the csv, or the partitioned
+    multi-year dataset) without loading it into pandas. Each query reads only the columns it
+    needs and the rows that aren't excluded (the filter is pushed down into the parquet
+    scan), one batch at a time. Each batch is grouped and summed by pyarrow
+    (Table.group_by), and the per-batch sums are summed again the same way, so only the
+    per-category totals ever reach Python. Results match PandasBackend on the same data.
+
+    years limits a multi-year (year=... partitioned) dataset to those years; several years
+    are grouped by year in the same scan. Finding the files is the slow part of setting
+    up, so build one backend per dataset and use for_years for each selection of years.
+    '''
+
+    def __init__(self, source, years=None, batch_size=250_000):
+        if ds is None:
+            raise ImportError("ArrowBackend needs pyarrow")
+        self.dataset = ds.dataset(str(source), format="parquet", partitioning="hive")
+        self.years = years
+        self.batch_size = batch_size
+
+    def for_years(self, years):
+        '''
+        The same dataset, limited to other years (without looking for the files again).
+        '''
+        backend = copy.copy(self)
+        backend.years = years
+        return backend
+
+    def _group_field(self, column):
+        return dashboard_columns.get(column, column)
+
+    def _columns(self, columns):
+        names = set(self.dataset.schema.names)
+        wanted = []
+        for column in columns:
+            derived = dashboard_columns.get(column)
+            if derived is not None and derived not in names:
+                # Older files without the derived column: compute it from its source per batch
+                wanted.append(derived_columns[derived][0])
+            wanted += [column, derived, missing_reason_column(column)]
+        return [c for c in dict.fromkeys(wanted) if c in names]
+
+    def _by_year(self):
+        return self.years is not None and len(self.years) > 1
+
+    def _tables(self, columns, expression=None):
+        '''
+        The scan as one pyarrow Table per batch, with derived columns added where the files
+        don't have them and dictionary columns decoded (batches can have different
+        dictionaries, which group_by can't combine).
+        '''
+        columns = self._columns(columns)
+        if self.years is not None:
+            year_filter = ds.field("year").isin(list(self.years))
+            expression = year_filter if expression is None else expression & year_filter
+            if self._by_year():
+                columns.append("year")
+
+        scanner = self.dataset.scanner(columns=columns, filter=expression,
+                                       batch_size=self.batch_size)
+        for batch in scanner.to_batches():
+            if not batch.num_rows:
+                continue
+            table = pa.Table.from_batches([batch])
+            for name, (source, function, _) in derived_columns.items():
+                if name not in table.column_names and source in table.column_names:
+                    table = table.append_column(
+                        name, pa.array(function(table[source].to_pandas()).astype(object)))
+            for i, field in enumerate(table.schema):
+                if pa.types.is_dictionary(field.type):
+                    table = table.set_column(i, field.name,
+                                             table[i].cast(field.type.value_type))
+            yield table
+
+    def _exclusion_filter(self, column, exclusions):
+        reason_name = missing_reason_column(column)
+        if reason_name not in self.dataset.schema.names:
+            reason_name = column
+        field = ds.field(reason_name)
+        return field.is_null() | ~field.isin(query_exclusions(exclusions))
+
+    def _grouped_sums(self, tables, keys, values):
+        '''
+        Sums by keys, over every batch, of the arrays values(batch) gives ({name: array}):
+        each batch is summed by group_by, then the batch sums are summed the same way. Rows
+        with a missing key are left out. Returns a pandas frame with keys, rows (the number of
+        rows) and one column per value.
+        '''
+        partials = []
+        for table in tables:
+            sums = pa.table({**{key: table[key] for key in keys},
+                             "rows": pa.array(np.ones(table.num_rows)), **values(table)})
+            names = sums.column_names[len(keys):]
+            partials.append(self._sum_by(sums, keys, names))
+        if not partials:
+            return pd.DataFrame(columns=keys + ["rows"])
+
+        totals = self._sum_by(pa.concat_tables(partials), keys, names)
+        for key in keys:
+            totals = totals.filter(pc.is_valid(totals[key]))
+        return totals.to_pandas()
+
+    @staticmethod
+    def _sum_by(table, keys, names):
+        # group_by names the sums <name>_sum (and where it puts the keys varies by version)
+        sums = table.group_by(keys).aggregate([(name, "sum") for name in names])
+        return sums.select(keys + [f"{name}_sum" for name in names]).rename_columns(keys + names)
+
+    @staticmethod
+    def _metric_values(table, metric_type, weighted=False):
+        '''
+        The arrays a metric needs for one batch (like survey_weights.metric_values):
+        numerator and denominator, plus each weight column times each of them if weighted.
+        '''
+        if metric_type == "volunteer":
+            is_yes = pc.fill_null(pc.equal(table["Volunteered_Past_Year"], "Yes"), False)
+            numerator = is_yes.cast(pa.float64())
+            denominator = pa.array(np.ones(table.num_rows))
+        else:
+            score = pc.fill_null(table["political_engagement_score"].cast(pa.float64()), np.nan)
+            has_score = pc.invert(pc.is_nan(score))
+            numerator = pc.if_else(has_score, score, 0.0)
+            denominator = has_score.cast(pa.float64())
+
+        values = {"numerator": numerator, "denominator": denominator}
+        if weighted:
+            weights = [pc.fill_null(table[weight], 0.0) for weight in
+                       [config.weight_column] + config.replicate_weight_columns]
+            for side, array in [("top", numerator), ("bottom", denominator)]:
+                for i, weight in enumerate(weights):
+                    values[f"{side}_{i}"] = pc.multiply(array, weight)
+        return values
+
+    def metric(self, group_column, metric_type, exclusions=None, weighted=False):
+        group = self._group_field(group_column)
+        keys = [group] + (["year"] if self._by_year() else [])
+        sums = self._grouped_sums(
+            self._tables(query_columns(group_column, metric_type, weighted),
+                         self._exclusion_filter(group_column, exclusions)), keys,
+            lambda table: self._metric_values(table, metric_type, weighted))
+
+        def result(rows):
+            # One row per category by now; MetricTotals turns the sums into the metric
+            totals = MetricTotals(group_column, metric_type, exclusions, weighted)
+            if rows.empty:
+                return totals.result()
+            parts = [rows[name].to_numpy() for name in ["rows", "numerator", "denominator"]]
+            if weighted:
+                parts += [rows[[name for name in rows.columns if name.startswith(f"{side}_")]]
+                          .to_numpy() for side in ["top", "bottom"]]
+            for i, category in enumerate(rows[group].tolist()):
+                totals.add_group(category, [part[i] for part in parts])
+            return totals.result()
+
+        # Several years give one row per category and year, like CubeBackend
+        if self._by_year():
+            return pd.concat([result(sums[sums["year"] == year]).assign(Year=str(year))
+                              for year in sorted(self.years)], ignore_index=True)
+        return result(sums)
+
+    def exclusion_stats(self, group_column, metric_type, exclusions=None):
+        totals = ExclusionTotals(group_column, metric_type, exclusions)
+        reason_name = missing_reason_column(group_column)
+        if reason_name not in self.dataset.schema.names:
+            reason_name = group_column
+        excluded_values = pa.array(totals.exclusions, type=pa.string())
+
+        for table in self._tables(query_columns(group_column, metric_type)):
+            reasons = table[reason_name].cast(pa.string())
+            excluded = pc.is_in(reasons, value_set=excluded_values)
+            totals.total += table.num_rows
+            for count in pc.value_counts(pc.filter(reasons, excluded)).to_pylist():
+                totals.by_reason[count["values"]] = (totals.by_reason.get(count["values"], 0)
+                                                     + count["counts"])
+            if metric_type == "engagement":
+                score = pc.fill_null(
+                    table["political_engagement_score"].cast(pa.float64()), np.nan)
+                no_score = pc.and_(pc.is_nan(score), pc.invert(excluded))
+                totals.by_reason[insufficient_data_reason] = (
+                    totals.by_reason.get(insufficient_data_reason, 0)
+                    + pc.sum(no_score.cast(pa.int64())).as_py())
+        return totals.result()
+
+    def pair_metric(self, row_column, column_column, metric_type, exclusions=None):
+        keys = [self._group_field(row_column), self._group_field(column_column)]
+        if keys[0] == keys[1]:
+            raise ValueError("pair_metric needs two different variables")
+        by_year = self._by_year()
+        expression = (self._exclusion_filter(row_column, exclusions)
+                      & self._exclusion_filter(column_column, exclusions))
+
+        def values(table):
+            volunteer = self._metric_values(table, "volunteer")
+            engagement = self._metric_values(table, "engagement")
+            return {"yes_count": volunteer["numerator"], "score_count": engagement["denominator"],
+                    "score_sum": engagement["numerator"]}
+
+        sums = self._grouped_sums(
+            self._tables([row_column, column_column, "Volunteered_Past_Year",
+                          "political_engagement_score"], expression),
+            keys + (["year"] if by_year else []), values)
+
+        def result(cells):
+            if cells.empty:
+                return pair_metric(pd.DataFrame(columns=pair_columns), row_column,
+                                   column_column, metric_type)
+            index = pd.DataFrame({
+                "row_variable": row_column,
+                "row_category": cells[keys[0]].to_numpy(dtype=object),
+                "column_variable": column_column,
+                "column_category": cells[keys[1]].to_numpy(dtype=object),
+                "count": cells["rows"].to_numpy(dtype=int),
+                "yes_count": cells["yes_count"].to_numpy(dtype=int),
+                "score_count": cells["score_count"].to_numpy(dtype=int),
+                "score_sum": cells["score_sum"].to_numpy(dtype=float),
+            })
+            # The axis order comes from the schema, since the scan only sees the values
+            for side, column in [("row", row_column), ("column", column_column)]:
+                order = {category: i for i, category in enumerate(
+                    category_order(column, list(index[f"{side}_category"].unique())))}
+                index[f"{side}_order"] = index[f"{side}_category"].map(order)
+            return pair_metric(index[pair_columns], row_column, column_column, metric_type)
+
+        if by_year:
+            return pd.concat([result(sums[sums["year"] == year]).assign(Year=str(year))
+                              for year in sorted(self.years)], ignore_index=True)
+        return result(sums)
+
+
+class CubeBackend:
+    '''
+    Answers queries from the precomputed aggregate cube (see aggregates.py), which is
+    fastest but only knows the exclusions it was built with (exclude_categories). A cube
+    with several survey years (multi_year.load_year_cubes) gives one row per category and
+    year, with a Year column. pair_metric needs the pair index (aggregates.build_pair_index)
+    as pairs.
+    '''
+
+    def __init__(self, cube, pairs=None):
+        self.cube = cube
+        self.pairs = pairs
+
+    def _check(self, exclusions):
+        if set(query_exclusions(exclusions)) != set(config.exclude_categories):
+            raise ValueError("The aggregate cube only has the default exclude_categories; "
+                             "use PandasBackend or ArrowBackend for other exclusions")
+
+    def metric(self, group_column, metric_type, exclusions=None, weighted=False):
+        self._check(exclusions)
+        years = sorted(self.cube["year"].unique()) if "year" in self.cube.columns else []
+        if len(years) > 1:
+            return pd.concat(
+                [cube_metric(self.cube[self.cube["year"] == year], group_column, metric_type,
+                             weighted=weighted).assign(Year=str(year)) for year in years],
+                ignore_index=True)
+        return cube_metric(self.cube, group_column, metric_type, weighted=weighted)
+
+    def exclusion_stats(self, group_column, metric_type, exclusions=None):
+        self._check(exclusions)
+        return cube_exclusion_stats(self.cube, group_column, metric_type)
+
+    def pair_metric(self, row_column, column_column, metric_type, exclusions=None):
+        self._check(exclusions)
+        if self.pairs is None:
+            raise ValueError("No pair index for this cube; rebuild it with the cleaning pipeline")
+        years = sorted(self.pairs["year"].unique()) if "year" in self.pairs.columns else []
+        if len(years) > 1:
+            return pd.concat(
+                [pair_metric(self.pairs[self.pairs["year"] == year], row_column, column_column,
+                             metric_type).assign(Year=str(year)) for year in years],
+                ignore_index=True)
+        return pair_metric(self.pairs, row_column, column_column, metric_type)
@@ -0,0 +1,180 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+import config
+from features import derived_columns, dashboard_columns, add_derived_columns
+
+
+# Labels that mean "we don't have an answer" rather than an actual response
+missing_reasons = ['No Answer', 'Refused', 'Refusal',
+                   'Do Not Know', 'Not in Universe', 'Missing']
+
+missing_reason_dtype = pd.CategoricalDtype(missing_reasons)
+
+# Columns without a code table in config.py
+other_column_dtypes = {
+    "Household_ID": "Int64",
+    "Household_ID_2": "Int64",
+    "US State": "category",
+    "political_engagement_score": "float64",
+    "engagement_level": pd.CategoricalDtype(
+        config.engagement_level_labels + ["Insufficient Data"], ordered=True),
+    **{column: "float64"
+       for column in [config.weight_column] + config.replicate_weight_columns},
+    **{column: dtype for column, (_, _, dtype) in derived_columns.items()},
+}
+
+
+def is_code(key):
+    return isinstance(key, str) and re.fullmatch(r"-?\d+", key) is not None
+
+
+def is_categorical(dtype):
+    return isinstance(dtype, pd.CategoricalDtype) or dtype == "category"
+
+
+def integer_dtype(max_value):
+    '''
+    Smallest nullable integer dtype that fits max_value.
+    '''
+    for dtype in ["Int8", "Int16", "Int32"]:
+        if max_value <= np.iinfo(dtype.lower()).max:
+            return dtype
+    return "Int64"
+
+
+def build_schema(codebook=None):
+    '''
+    Builds the dtype schema for the cleaned CEV data from config.selected_variables,
+    config.rename_mapping and the <variable>_dict tables, or from another year's codebook
+    (multi_year.year_codebook: selected_variables, rename_mapping and tables).
+
+    Returns (dtypes, numeric_columns):
+        - dtypes: renamed column -> pandas dtype. Response columns are ordered categoricals
+          (answers in code order, then the missing-reason labels), numeric columns are
+          nullable integers.
+        - numeric_columns: renamed column -> {label: number} for labels that stand for a
+          number (e.g. Age's '80-84' top code is stored as 80). Non-numeric labels in these
+          columns go into a separate <column>_Missing_Reason category column.
+    '''
+    if codebook is None:
+        codebook = {"selected_variables": config.selected_variables,
+                    "rename_mapping": config.rename_mapping,
+                    "tables": {variable: getattr(config, f"{variable}_dict")
+                               for variable in config.selected_variables
+                               if hasattr(config, f"{variable}_dict")}}
+
+    dtypes = {}
+    numeric_columns = {}
+
+    for variable in dict.fromkeys(codebook["selected_variables"]):
+        table = codebook["tables"].get(variable)
+        column = codebook["rename_mapping"][variable]
+        if table is None:
+            continue
+
+        codes = sorted((int(key), label)
+                       for key, label in table.items() if is_code(key))
+
+        if any(isinstance(label, int) for label in table.values()):
+            top_codes = {label: number for number, label in codes
+                         if isinstance(label, str) and label not in missing_reasons}
+            max_value = max(number for number, _ in codes)
+            dtypes[column] = integer_dtype(max_value)
+            numeric_columns[column] = top_codes
+        else:
+            answers = [label for _, label in codes if label not in missing_reasons]
+            # Labels that only show up as non-code keys (e.g. pes16's 'Yes')
+            answers += [label for label in table.values()
+                        if label not in answers and label not in missing_reasons]
+            categories = list(dict.fromkeys(answers)) + missing_reasons
+            dtypes[column] = pd.CategoricalDtype(categories, ordered=True)
+
+    dtypes.update(other_column_dtypes)
+
+    return dtypes, numeric_columns
+
+
+cev_dtypes, cev_numeric_columns = build_schema()
+
+
+def missing_reason_column(column):
+    return f"{column}_Missing_Reason"
+
+
+def _map_distinct(series, func):
+    '''
+    Applies func to each distinct value of series (not to each row) and maps the
+    results back onto the rows.
+    '''
+    codes, uniques = pd.factorize(series)
+    results = pd.Series([func(value) for value in uniques] + [np.nan], dtype=object)
+    return pd.Series(results.to_numpy()[codes], index=series.index)
+
+
+def apply_schema(df, dtypes=None, numeric_columns=None):
+    '''
+    Converts a cleaned CEV frame (object/str columns, as produced by the notebook or read
+    from csv) to the declared schema (by default the 2021 one, cev_dtypes; pass build_schema's
+    output for another year). Columns not in the schema are left as they are.
+    '''
+    if dtypes is None:
+        dtypes, numeric_columns = cev_dtypes, cev_numeric_columns
+    converted = {}
+
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+
+        if column in numeric_columns:
+            top_codes = numeric_columns[column]
+            numbers = pd.to_numeric(
+                _map_distinct(df[column], lambda value: top_codes.get(value, value)),
+                errors='coerce')
+            converted[column] = numbers.round().astype(dtype)
+
+            reason_name = missing_reason_column(column)
+            if reason_name in df.columns:
+                reasons = df[reason_name]
+            else:
+                reasons = df[column].where(numbers.isna())
+            converted[reason_name] = reasons.astype(missing_reason_dtype)
+        elif is_categorical(dtype):
+            converted[column] = df[column].astype(dtype)
+        else:
+            converted[column] = pd.to_numeric(
+                df[column], errors='coerce').astype(dtype)
+
+    return df.assign(**converted)
+
+
+def wanted_columns(columns):
+    '''
+    columns plus their missing-reason columns and the derived columns charted in their place
+    (e.g. Age brings Age_Missing_Reason and Age_Group).
+    '''
+    return (set(columns) | {missing_reason_column(c) for c in columns}
+            | {dashboard_columns[c] for c in columns if c in dashboard_columns})
+
+
+def read_cleaned_csv(path, columns=None):
+    '''
+    Reads the cleaned CEV csv straight into the schema. Categorical and coded numeric columns
+    are parsed as categories first, so the conversion only looks at each distinct value once.
+    columns optionally limits which columns are loaded (their missing-reason columns come along).
+    '''
+    header = pd.read_csv(path, nrows=0).columns
+    if columns is not None:
+        columns = wanted_columns(columns)
+        header = [column for column in header if column in columns]
+
+    dtype = {column: "category" for column in header
+             if is_categorical(cev_dtypes.get(column)) or column in cev_numeric_columns
+             or column.endswith("_Missing_Reason")}
+
+    df = pd.read_csv(path, usecols=header, dtype=dtype)
+
+    # csvs cleaned before a derived column existed get it here, once, at load
+    return add_derived_columns(apply_schema(df))
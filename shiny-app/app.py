@@ -1,62 +1,153 @@
-from shiny import App, render, ui, reactive
-from shinywidgets import render_altair, output_widget
+from shiny import App, render, ui, reactive, req
 import pandas as pd
-import altair as alt
 
-from pathlib import Path
+import os
 
+import sys
+from pathlib import Path
 
-# Load dataset from data folder
+# The shared modules (config.py, aggregates.py, etc.) live in the repo root, next to the notebook
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config import variable_mapping, exclude_categories
+from aggregates import load_aggregate_cube, load_pair_index
+from exclusions import format_exclusion_stats
+from data_cache import file_hash, fresh_cache_path
+from data_store import load_shared_data
+from query_backend import CubeBackend, PandasBackend, ArrowBackend, dashboard_query_columns
+from dashboard_charts import metric_chart_spec, pair_heatmap_spec
+from chart_render import ChartRenderer, LatestRequest
+from spec_cache import SpecCache
+from instrumentation import metrics
+from multi_year import (available_years, load_year_cubes, load_year_pairs, year_cube_path,
+                        parquet_root)
+
+# The multi-year dataset (see multi_year.py), if it's been built. Each year's cube is only
+# loaded the first time someone picks that year.
+dataset_root = Path("data/cev")
+survey_years = available_years(dataset_root)
+year_cubes = {}
+
+# Otherwise, load the precomputed aggregates for the dataset in the data folder (see aggregates.py).
+# The charts and exclusion stats are answered from this instead of the respondent-level data.
 data_path = Path("data/cev_2021_cleaned.csv")
-cev_all_2021_filter = pd.read_csv(data_path, low_memory=False)
+
+# Where chart data comes from (see query_backend.py): "cube" (the precomputed aggregates),
+# "arrow" (scans the parquet data per query, for data too big for memory) or "pandas"
+# (the respondent-level data in memory, single dataset only)
+query_backend = os.environ.get("DASHBOARD_BACKEND", "cube")
+if query_backend not in ("cube", "arrow", "pandas"):
+    raise ValueError(f"Unknown DASHBOARD_BACKEND {query_backend!r}; use cube, arrow or pandas")
+if query_backend == "pandas" and survey_years:
+    raise ValueError("DASHBOARD_BACKEND=pandas only works with the single cleaned csv, not the "
+                     f"multi-year dataset in {dataset_root}; use cube or arrow")
+
+if survey_years:
+    aggregate_cube = pair_index = dataset_version = None
+else:
+    # The csv is hashed once: the hash checks that the cube, pair index and parquet cache
+    # are up to date, and it's part of every cache key, so cached charts never outlive the
+    # data they were made from
+    dataset_version = file_hash(data_path)
+    with metrics.timed("load_cube"):
+        aggregate_cube = load_aggregate_cube(data_path, dataset_version)
+        # The two-way counts for the "Compare with" heatmap
+        pair_index = load_pair_index(data_path, dataset_version)
+
+# The arrow backend finds its parquet files once; the single dataset's parquet cache is
+# rebuilt first if it's missing or doesn't match the csv
+if query_backend == "arrow":
+    arrow_backend = ArrowBackend(parquet_root(dataset_root) if survey_years
+                                 else fresh_cache_path(data_path, dataset_version))
+# The pandas backend maps the shared data store (see data_store.py), so the app workers
+# share one copy of the columns the charts query instead of each loading the whole csv
+if query_backend == "pandas":
+    respondents = load_shared_data(data_path, dashboard_query_columns(), dataset_version)
+
+# Charts (as Vega-Lite JSON) and exclusion text are built on a thread pool shared by every
+# session on this worker and kept in a bounded LRU cache (see chart_render.py and
+# spec_cache.py), so a repeat view is just a cache lookup
+spec_cache = SpecCache(max_entries=256, max_age=3600)
+chart_renderer = ChartRenderer(spec_cache)
 
 ### Base definitions/functions used for all apps below ##
 
-exclude_categories = ['No Answer', 'Refused', 'Do Not Know', 'Not in Universe']
 
-variable_mapping = {
-    "Household_Size": "Household Size",
-    "US State": "US State",
-    "Family_Income_Level": "Family Income",
-    "Education_Level": "Education Level",
-    "Urban_Rural_Status": "Urban/Rural Status",
-    "Community_Improvement_Activities": "Community Involvement",
-    "Posted_Views_On_Social_Media": "Social Media Use",
-    "Age": "Age",
-    "Gender": "Gender",
-    "Race_Ethnicity": "Race/Ethnicity",
-    "Marital_Status": "Marital Status"
-}
+# (backend, version) for each selection of survey years, built the first time it's picked
+backends = {}
 
 
-def calculate_exclusion_stats(category, metric_type=None):
+def selected_backend(years):
     '''
-    Counts the number and proportion of responses that are exclusded, nonresponse, or out of universe, etc.
+    (backend, version) for the selected survey years, with version going into the chart
+    cache keys. For the cube backend that's the years' cubes stacked with a year column, or
+    the single-dataset cube when there's no multi-year data. Built once per selection and
+    then reused by every request.
     '''
+    key = tuple(years)
+    if key not in backends:
+        backends[key] = build_backend(years)
+    return backends[key]
+
+
+def build_backend(years):
+    if not survey_years:
+        if query_backend == "arrow":
+            return arrow_backend, dataset_version
+        if query_backend == "pandas":
+            return PandasBackend(respondents), dataset_version
+        return CubeBackend(aggregate_cube, pair_index), dataset_version
+
+    for year in years:
+        if year not in year_cubes:
+            with metrics.timed("load_cube"):
+                year_cubes[year] = (load_year_cubes(dataset_root, [year]),
+                                    file_hash(year_cube_path(dataset_root, year)),
+                                    load_year_pairs(dataset_root, [year]))
+
+    version = "-".join(year_cubes[year][1] for year in years)
+    if query_backend == "arrow":
+        return arrow_backend.for_years(years), version
+
+    cube = pd.concat([year_cubes[year][0] for year in years], ignore_index=True)
+    pairs = [year_cubes[year][2] for year in years]
+    pairs = None if any(p is None for p in pairs) else pd.concat(pairs, ignore_index=True)
+    return CubeBackend(cube, pairs), version
+
+
+def vega_embed(spec, element_id):
+    '''
+    Draws a chart from its Vega-Lite JSON (as cached, see spec_cache.py) with vega-embed in
+    the browser, so a cache hit goes straight to the page instead of being turned back into
+    an Altair chart first.
+    '''
+    # "</" would end the script tag early if it showed up in a label
+    spec = spec.replace("</", "<\\/")
+    return ui.TagList(
+        ui.div(id=element_id),
+        ui.tags.script(f"vegaEmbed('#{element_id}', {spec}, {{actions: false}});")
+    )
 
-    data = cev_all_2021_filter.copy()
-
-    excluded_category = data[data[category].isin(exclude_categories)]
-
-    # For engagement score, also count insufficient data
-    if metric_type == "engagement":
-        excluded_engagement = data[pd.isna(data['political_engagement_score'])]
-        excluded = pd.concat(
-            [excluded_category, excluded_engagement]).drop_duplicates()
-    else:
-        excluded = excluded_category
-
-    total_count = len(data)
-    excluded_count = len(excluded)
-    excluded_percent = (excluded_count / total_count) * 100
 
-    return (f"Number of responses excluded: {excluded_count:,} out of {total_count:,}\n\n || "
-            f"Percentage of total responses excluded: {excluded_percent:.1f}%")
+def calculate_exclusion_stats(backend, category, metric_type=None):
+    '''
+    Counts the number and proportion of responses that are exclusded, nonresponse, or out of universe, etc.
+    Returns the numbers (see exclusions.exclusion_summary); formatting is left to the UI.
+    '''
+    # For engagement score, this also counts insufficient data
+    with metrics.timed("exclusion_stats"):
+        return backend.exclusion_stats(category, metric_type, exclude_categories)
 
 ###
 
 
 app_ui = ui.page_fluid(
+    # vega-embed draws the cached chart specs (see vega_embed)
+    ui.head_content(
+        ui.tags.script(src="https://cdn.jsdelivr.net/npm/vega@5"),
+        ui.tags.script(src="https://cdn.jsdelivr.net/npm/vega-lite@5"),
+        ui.tags.script(src="https://cdn.jsdelivr.net/npm/vega-embed@6")
+    ),
     ui.panel_title("Civic Engagement Analysis Dashboard"),
     ui.layout_sidebar(
         ui.sidebar(
@@ -65,6 +156,12 @@ app_ui = ui.page_fluid(
                 "Select Variable to Analyze",
                 choices=list(variable_mapping.values())
             ),
+            # A second variable switches the chart to a two-way heatmap
+            ui.input_select(
+                "compare_with",
+                "Compare with (heatmap, unweighted)",
+                choices=["None"] + list(variable_mapping.values())
+            ),
             ui.input_select(
                 "metric",
                 "Select Metric",
@@ -77,17 +174,32 @@ app_ui = ui.page_fluid(
                 "sort_bars",
                 "Sort bars by selected metric",
                 value=False
-            )
+            ),
+            ui.input_checkbox(
+                "weighted",
+                "Survey-weighted estimates (with 95% error bars)",
+                value=False
+            ),
+            # Only shown when there's a multi-year dataset; several years are charted side by side
+            *([ui.input_selectize(
+                "years",
+                "Survey Year(s)",
+                choices=[str(year) for year in survey_years],
+                selected=str(survey_years[-1]),
+                multiple=True
+            )] if survey_years else [])
         ),
         ui.div(
-            output_widget("volunteer_plot"),
+            ui.output_ui("volunteer_plot"),
             style="margin-bottom: 100px;"
         ),
         ui.div(
             ui.output_text("exclusion_stats_output"),
             # Add padding above and below the stats so this doesn't get covered up
             style="padding: 20px 0;"
-        )
+        ),
+        # Timings and cache stats; only shown when the url has ?debug
+        ui.output_ui("debug_panel")
     )
 )
 
@@ -100,28 +212,10 @@ def server(input, output, session):
         '''
         return {v: k for k, v in variable_mapping.items()}[display_name]
 
-    @reactive.Calc
-    def processed_data():
-        """
-        processes the data and picks the category based on whatever the user selects
-        adds binning if the user selects "age" as a category
-        """
-        selected_column = get_column_name(input.variable())
-
-        # Attribution: ChatGPT
-        # Asked "how to bin age-related data using pandas for easier bar-graphing", suggested using pd.cut()
-        if selected_column == "Age":
-            numeric_age = pd.to_numeric(
-                cev_all_2021_filter['Age'], errors='coerce')
-
-            age_groups = pd.cut(
-                numeric_age,
-                bins=[0, 25, 35, 45, 55, 65, 100],
-                labels=['18-25', '26-35', '36-45', '46-55', '56-65', '65+']
-            )
-            return cev_all_2021_filter.assign(Age=age_groups)
-
-        return cev_all_2021_filter
+    def current_backend():
+        years = sorted(int(year) for year in input.years()) if survey_years else []
+        req(years or not survey_years)
+        return selected_backend(years)
 
     @output
     @render.text
@@ -141,82 +235,67 @@ def server(input, output, session):
         }
         return descriptions[selected_var]
 
+    latest_plot = LatestRequest(chart_renderer)
+    latest_stats = LatestRequest(chart_renderer)
+
     @output
-    @render_altair
-    def volunteer_plot():
-        # Get processed data with any special handling (like age groups)
-        data = processed_data()
-        selected_column = get_column_name(input.variable())
+    @render.ui
+    async def volunteer_plot():
+        display_name = input.variable()
         metric_type = input.metric()
-
-        filtered_data = data[~data[selected_column].isin(exclude_categories)]
-
-        if metric_type == "volunteer":
-
-            metric_data = (filtered_data
-                           .groupby(selected_column)['Volunteered_Past_Year']
-                           .agg(lambda x: (x == "Yes").mean() * 100)
-                           .reset_index()
-                           .rename(columns={
-                               selected_column: input.variable(),
-                               'Volunteered_Past_Year': 'Metric_Value'})
-                           )
-
-            y_title = "Percentage Volunteered"
-            tooltip_title = "Volunteer Rate (%)"
-
-        else:
-            # Engagement score calculation
-            metric_data = (filtered_data
-                           .groupby(selected_column)['political_engagement_score']
-                           .mean()
-                           .reset_index()
-                           .rename(columns={
-                               selected_column: input.variable(),
-                               'political_engagement_score': 'Metric_Value'})
-                           )
-            y_title = "Average Political Engagement Score"
-            tooltip_title = "Engagement Score"
-
-        # Debugging - handle empty data - suggested by ChatGPT
-        if metric_data.empty:
-            print(f"No data available for {input.variable()}.")
-            return alt.Chart(pd.DataFrame({'No Data': [1]})).mark_text(
-                text="No data available"
-            ).encode()
-
-        # Sort if requested
-        if input.sort_bars():
-            metric_data = metric_data.sort_values(
-                'Metric_Value', ascending=False)
-
-        chart = alt.Chart(metric_data).mark_bar().encode(
-            x=alt.X(input.variable(), title=input.variable(),
-                    sort=alt.EncodingSortField(
-                    field='Metric_Value',
-                    order='descending'
-                    ) if input.sort_bars() else None,
-                    axis=alt.Axis(labelAngle=45)),
-            y=alt.Y('Metric_Value', title=y_title),
-            tooltip=[
-                alt.Tooltip(input.variable()),
-                alt.Tooltip('Metric_Value',
-                            title=tooltip_title, format='.1f')
-            ]
-        ).properties(
-            title=f"{y_title} by {input.variable()}",
-            width=600,
-            height=300
-        )
-
-        return chart
+        sort_bars = input.sort_bars()
+        weighted = input.weighted()
+        compare_with = input.compare_with()
+        backend, version = current_backend()
+
+        if compare_with not in ("None", display_name):
+            spec = await latest_plot.run(
+                (version, "pairs", display_name, compare_with, metric_type),
+                pair_heatmap_spec, backend, get_column_name(display_name), display_name,
+                get_column_name(compare_with), compare_with, metric_type)
+            req(spec is not None, cancel_output=True)
+            return vega_embed(spec, "volunteer_plot_chart")
+
+        # The query and spec build are timed where they run, in the render worker
+        spec = await latest_plot.run(
+            (version, "chart", display_name, metric_type, sort_bars, weighted),
+            metric_chart_spec, backend, get_column_name(display_name),
+            display_name, metric_type, sort_bars, weighted)
+        # None means the user already picked something else; keep the current chart
+        req(spec is not None, cancel_output=True)
+
+        return vega_embed(spec, "volunteer_plot_chart")
 
     @output
     @render.text
-    def exclusion_stats_output():
+    async def exclusion_stats_output():
         selected_column = get_column_name(input.variable())
         metric_type = input.metric()
-        return calculate_exclusion_stats(selected_column, metric_type)
+        backend, version = current_backend()
+
+        stats = await latest_stats.run(
+            (version, "exclusions", selected_column, metric_type),
+            calculate_exclusion_stats, backend, selected_column, metric_type)
+        req(stats is not None, cancel_output=True)
+
+        return format_exclusion_stats(stats)
+
+    @output
+    @render.ui
+    def debug_panel():
+        req("debug" in input[".clientdata_url_search"]())
+        # Refresh every few seconds while the panel is open
+        reactive.invalidate_later(5)
+
+        cache_stats = ", ".join(f"{name}: {value:,.2f}" if isinstance(value, float)
+                                else f"{name}: {value:,}"
+                                for name, value in spec_cache.stats().items())
+        return ui.div(
+            ui.h4("Debug: stage timings (last 1,000 calls per stage)"),
+            ui.HTML(metrics.summary().to_html(index=False, float_format="{:.2f}".format)),
+            ui.p(f"Chart cache: {cache_stats}"),
+            style="font-size: small; padding-top: 20px;"
+        )
 
 
 app = App(app_ui, server)
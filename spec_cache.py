@@ -0,0 +1,80 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class SpecCache:
+    '''
+    Process-level LRU cache for rendered dashboard output (serialized Vega-Lite JSON for the
+    charts). Keys should include the dataset hash, so a new dataset never gets an old chart.
+
+    Entries are dropped when they're older than max_age seconds, and the least recently used
+    ones are evicted once there are more than max_entries or their total size passes
+    max_bytes. hits/misses/evictions/expired are counted so the limits can be sized from
+    stats().
+    '''
+
+    def __init__(self, max_entries=256, max_bytes=50_000_000, max_age=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def value_size(value):
+        return len(value) if isinstance(value, (str, bytes)) else sys.getsizeof(value)
+
+    def get(self, key):
+        '''
+        The cached value for key, or None (counted as a miss) if it's missing or too old.
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.max_age:
+                self._remove(key)
+                self.expired += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.monotonic())
+            self.size += self.value_size(value)
+
+            while self.entries and (len(self.entries) > self.max_entries
+                                    or self.size > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        value, _ = self.entries.pop(key)
+        self.size -= self.value_size(value)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "bytes": self.size,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions, "expired": self.expired}
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+import config
+
+
+class ReplicateWeights:
+    '''
+    The person weight and the 160 replicate weights as one (respondents x 161) matrix, so a
+    weighted total for every group and every replicate is a single matrix product instead
+    of one groupby per replicate.
+
+    Column 0 is the full-sample weight, columns 1-160 the replicates. Missing weights count
+    as 0 (the respondent isn't in the weighted sample).
+    '''
+
+    def __init__(self, df, weight=None, replicates=None, variance_factor=None,
+                 chunksize=100_000):
+        weight = config.weight_column if weight is None else weight
+        replicates = config.replicate_weight_columns if replicates is None else replicates
+        self.weights = df[[weight] + list(replicates)].to_numpy(dtype=float, na_value=0)
+        self.variance_factor = (config.replicate_variance_factor if variance_factor is None
+                                else variance_factor)
+        self.chunksize = chunksize
+
+    def totals(self, codes, n_groups, values):
+        '''
+        Weighted totals of values by group: an (n_groups x 161) array where entry [g, r] is
+        the sum of values * replicate r's weight over the respondents in group g. codes gives
+        each respondent's group (0 .. n_groups-1). The indicator matrix is built a chunk of
+        rows at a time so it never gets bigger than n_groups x chunksize.
+        '''
+        totals = np.zeros((n_groups, self.weights.shape[1]))
+        for start in range(0, len(codes), self.chunksize):
+            stop = start + self.chunksize
+            chunk_codes = codes[start:stop]
+            indicator = np.zeros((n_groups, len(chunk_codes)))
+            indicator[chunk_codes, np.arange(len(chunk_codes))] = values[start:stop]
+            totals += indicator @ self.weights[start:stop]
+        return totals
+
+    def ratio(self, codes, n_groups, numerator, denominator):
+        '''
+        Weighted ratio sum(w * numerator) / sum(w * denominator) for every group, with its
+        replicate standard error. Returns (estimates, standard_errors), one value per group.
+        '''
+        return replicate_ratio(self.totals(codes, n_groups, numerator),
+                               self.totals(codes, n_groups, denominator),
+                               self.variance_factor)
+
+
+def replicate_ratio(top, bottom, variance_factor=None):
+    '''
+    Ratio estimates and replicate standard errors from (groups x 161) weighted totals, e.g.
+    totals added up over several chunks of data.
+    '''
+    if variance_factor is None:
+        variance_factor = config.replicate_variance_factor
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratios = top / bottom
+
+    deviations = ratios[:, 1:] - ratios[:, :1]
+    standard_errors = np.sqrt(variance_factor * (deviations ** 2).sum(axis=1))
+    return ratios[:, 0], standard_errors
+
+
+def metric_values(df, metric_type):
+    '''
+    (numerator, denominator) arrays for a dashboard metric: volunteered "Yes" over everyone
+    for the volunteer rate, the engagement score over respondents with a score otherwise.
+    '''
+    if metric_type == "volunteer":
+        yes = (df['Volunteered_Past_Year'] == "Yes").to_numpy(dtype=float)
+        return yes, np.ones(len(df))
+
+    score = pd.to_numeric(df['political_engagement_score'], errors='coerce').to_numpy(dtype=float)
+    has_score = ~np.isnan(score)
+    return np.where(has_score, score, 0), has_score.astype(float)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules under test (config.py, polarization.py, etc.) live in the repo root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
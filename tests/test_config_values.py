@@ -0,0 +1,50 @@
+import pandas as pd
+
+import config
+import exclusions
+import person_merge
+import polarization
+import survey_weights
+
+
+# The pipeline reloads config.py before each run, so these modules have to read config
+# values when they're called, not copy them at import. monkeypatch stands in for the reload.
+
+
+def test_exclusions_follow_config(monkeypatch):
+    df = pd.DataFrame({"Volunteered_Past_Year": ["Yes", "No", "Refused"]})
+    monkeypatch.setattr(config, "exclude_categories", ["No"])
+
+    assert exclusions.ExclusionStats(df).counts("Volunteered_Past_Year")["by_reason"] == {"No": 1}
+
+
+def test_merge_keys_follow_config(monkeypatch):
+    cev = pd.DataFrame({"person": [1, 2], "answer": ["a", "b"]})
+    cps = pd.DataFrame({"person": [2, 3], "answer": [None, "c"]})
+    monkeypatch.setattr(config, "merge_keys", ["person"])
+    monkeypatch.setattr(config, "selected_variables", ["answer"])
+
+    merged, counts = person_merge.merge_person_files(cev, cps)
+    assert counts["matched"] == 1
+    assert list(merged.columns) == ["person", "answer"]
+
+
+def test_weights_follow_config(monkeypatch):
+    df = pd.DataFrame({"w": [1.0, 2.0], "r1": [1.0, 1.0], "r2": [2.0, 2.0]})
+    monkeypatch.setattr(config, "weight_column", "w")
+    monkeypatch.setattr(config, "replicate_weight_columns", ["r1", "r2"])
+    monkeypatch.setattr(config, "replicate_variance_factor", 0.5)
+
+    weights = survey_weights.ReplicateWeights(df)
+    assert weights.weights.shape == (2, 3)
+    assert weights.variance_factor == 0.5
+
+
+def test_crosswalks_follow_config(monkeypatch):
+    df = pd.DataFrame({"V201228": [1, 2]})
+    monkeypatch.setattr(config, "anes_crosswalks",
+                        {"V201228": {"Party": {1: "Democrat"}}})
+
+    df, unmapped = polarization.apply_crosswalks(df)
+    assert df["Party"].tolist()[0] == "Democrat"
+    assert unmapped == {"V201228": {2: 1}}
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_store
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def cleaned(tmp_path, monkeypatch):
+    '''
+    A csv path plus the typed frame load_cleaned_data would give for it, with one column of
+    each kind the cleaned data has.
+    '''
+    df = pd.DataFrame({
+        "Volunteered_Past_Year": pd.Categorical(["Yes", "No", None, "Yes"],
+                                                categories=["Yes", "No", "Refused"]),
+        "Education_Level": pd.Categorical(["High", None, "Low", "Low"],
+                                          categories=["Low", "High"], ordered=True),
+        "Age": pd.array([34, None, 80, 17], dtype="Int8"),
+        "Household_ID": pd.array([1, 2, None, 4], dtype="Int64"),
+        "Is_Adult": pd.array([True, None, True, False], dtype="boolean"),
+        "political_engagement_score": [12.5, np.nan, 80.0, 0.0],
+        "Has_Score": [True, False, True, True],
+    })
+    csv_path = tmp_path / "cleaned.csv"
+    df.to_csv(csv_path, index=False)
+    monkeypatch.setattr(data_store, "load_cleaned_data", lambda path, columns=None, source_hash=None: df.copy())
+    return csv_path, df
+
+
+def address(array):
+    return array.__array_interface__["data"][0]
+
+
+def test_round_trip(cleaned):
+    csv_path, df = cleaned
+    store = data_store.DataStore.attach(csv_path)
+
+    assert store.columns == list(df.columns)
+    pd.testing.assert_frame_equal(store.to_pandas(), df)
+
+
+def test_columns_are_views_of_the_mapped_file(cleaned):
+    csv_path, _ = cleaned
+    store = data_store.DataStore.attach(csv_path)
+    df = store.to_pandas()
+
+    def mapped(name):
+        return store.table.column(name).chunk(0).buffers()[1].address
+
+    assert address(df["political_engagement_score"].to_numpy()) == mapped(
+        "political_engagement_score")
+    assert address(df["Volunteered_Past_Year"].array.codes) == mapped("Volunteered_Past_Year")
+    assert address(df["Household_ID"].array._data) == mapped("Household_ID")
+    assert address(df["Household_ID"].array._mask) == mapped("Household_ID__mask")
+
+
+def test_older_store_is_rebuilt(cleaned, monkeypatch):
+    csv_path, _ = cleaned
+    path = data_store.build_store(csv_path)
+    assert data_store.stored_source_hash(path) is not None
+
+    monkeypatch.setattr(data_store, "store_format", b"0")
+    assert data_store.stored_source_hash(path) is None
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+import config
+from decoder import CodeTableDecoder
+
+
+raw_values = ['1', '2', '6', '-1', '-3', '.r', 'Yes', None, np.nan, '99']
+
+
+def test_missing_values_get_the_none_label():
+    decoder = CodeTableDecoder({"pes16d": config.pes16d_dict, "pes7": config.pes7_dict})
+    df = pd.DataFrame({"pes16d": raw_values, "pes7": raw_values})
+
+    decoded = decoder.decode(df)
+    for column in ["pes16d", "pes7"]:
+        assert decoded[column][7] == 'Missing'
+        assert decoded[column][8] == 'Missing'
+        # Same labels as mapping through the whole table, which is how the notebook decoded
+        expected = df[column].map(dict(getattr(config, f"{column}_dict")))
+        pd.testing.assert_series_equal(decoded[column].astype(object), expected.astype(object),
+                                       check_names=False)
+
+
+def test_missing_values_stay_missing_without_a_none_label():
+    decoder = CodeTableDecoder({"pes16": config.pes16_dict})
+    assert None not in dict(config.pes16_dict)
+
+    decoded = decoder.decode_column(pd.Series(['1', None, np.nan]), "pes16")
+    assert decoded.isna().tolist() == [False, True, True]
+
+
+def test_missing_values_are_not_unmapped():
+    decoder = CodeTableDecoder({"pes16d": config.pes16d_dict})
+    report = decoder.unmapped_values(pd.DataFrame({"pes16d": raw_values}))
+
+    assert '99' in report["value"].tolist()
+    assert report["value"].notna().all()
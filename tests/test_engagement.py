@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import config
+
+
+frequency_answers = list(config.frequency_scores) + [
+    'No Answer', 'Refusal', 'Do Not Know', 'Not in Universe', 'Missing', np.nan]
+yes_no_answers = ['Yes', 'No', 'No Answer', 'Refused', 'Do Not Know', 'Not in Universe',
+                  'Missing', np.nan]
+
+
+def old_engagement_level(score):
+    # score_to_category from the row-wise add_engagement_score this replaced
+    if pd.isna(score):
+        return "Insufficient Data"
+    if score >= 80:
+        return "Very High Engagement"
+    elif score >= 60:
+        return "High Engagement"
+    elif score >= 40:
+        return "Moderate Engagement"
+    elif score >= 20:
+        return "Low Engagement"
+    else:
+        return "Very Low Engagement"
+
+
+@pytest.fixture
+def responses():
+    '''
+    Engagement answers with every valid response and every missing/refusal code, plus the
+    all-valid and all-missing extremes.
+    '''
+    rng = np.random.default_rng(0)
+    n_rows = 2000
+    df = pd.DataFrame({
+        column: rng.choice(np.array(yes_no_answers if scores is config.yes_no_scores
+                                    else frequency_answers, dtype=object), n_rows)
+        for column, scores in config.engagement_component_scores.items()
+    })
+    extremes = pd.DataFrame([
+        {'Boycott_Based_On_Values': 'Yes', 'Contacted_Public_Official': 'Yes',
+         'Discussed_Issues_With_Neighbors': 'Basically Every Day',
+         'Posted_Views_On_Social_Media': 'Basically Every Day',
+         'Frequency_Of_News_Consumption': 'Basically Every Day'},
+        {column: 'Refusal' for column in config.engagement_component_scores},
+        {column: np.nan for column in config.engagement_component_scores},
+    ])
+    return pd.concat([df, extremes], ignore_index=True)
+
+
+def test_scores_match_row_function(responses):
+    expected = responses.apply(config.calculate_engagement_score, axis=1).astype(float)
+    scores = config.calculate_engagement_scores(responses)
+
+    np.testing.assert_allclose(scores.to_numpy(), expected.to_numpy(), equal_nan=True)
+    # The fixture covers both scored and unscored respondents
+    assert scores.isna().any() and scores.notna().any()
+
+
+def test_levels_match_row_function(responses):
+    expected = responses.apply(config.calculate_engagement_score, axis=1).map(
+        old_engagement_level)
+    scored = config.add_engagement_score(responses.copy())
+
+    assert scored['engagement_level'].astype(str).tolist() == expected.tolist()
+
+
+def test_missing_column_counts_as_unanswered(responses):
+    without_news = responses.drop(columns='Frequency_Of_News_Consumption')
+    expected = without_news.apply(config.calculate_engagement_score, axis=1).astype(float)
+
+    np.testing.assert_allclose(config.calculate_engagement_scores(without_news).to_numpy(),
+                               expected.to_numpy(), equal_nan=True)
+
+
+def test_unknown_weight_column_raises(responses):
+    with pytest.raises(KeyError):
+        config.calculate_engagement_scores(responses, weights={**config.engagement_weights,
+                                                               'Not_A_Component': 10})
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+import pytest
+
+from instrumentation import StageMetrics
+
+
+def test_cancelled_blocks_are_not_recorded():
+    metrics = StageMetrics()
+    with pytest.raises(asyncio.CancelledError):
+        with metrics.timed("chart_spec"):
+            raise asyncio.CancelledError()
+    with metrics.timed("query_metric"):
+        pass
+
+    assert list(metrics.summary()["stage"]) == ["query_metric"]
+    assert metrics.active == {}
+
+
+def test_memory_change_is_dropped_when_threads_overlap():
+    metrics = StageMetrics()
+    inside, done = threading.Event(), threading.Event()
+
+    def other_render():
+        with metrics.timed("other"):
+            inside.set()
+            done.wait()
+
+    thread = threading.Thread(target=other_render)
+    thread.start()
+    inside.wait()
+    with metrics.timed("overlapped"):
+        pass
+    done.set()
+    thread.join()
+    with metrics.timed("alone"):
+        with metrics.timed("nested"):
+            pass
+
+    assert len(metrics.memory_deltas["overlapped"]) == 0
+    assert len(metrics.memory_deltas["other"]) == 0
+    assert metrics.counts["overlapped"] == metrics.counts["other"] == 1
+    if metrics.memory_deltas["alone"]:
+        # Nested blocks on one thread don't count as overlapping
+        assert len(metrics.memory_deltas["nested"]) == 1
@@ -0,0 +1,32 @@
+import pytest
+
+import config
+import multi_year
+import schema
+from code_tables import CodeTable
+
+
+def test_unchecked_year_raises(monkeypatch):
+    monkeypatch.setattr(config, "year_overrides", {2021: {}})
+
+    with pytest.raises(ValueError, match="2019"):
+        multi_year.year_codebook(2019)
+    with pytest.raises(ValueError, match="cev_years"):
+        multi_year.year_codebook(1999)
+
+
+def test_year_schema_follows_its_codebook(monkeypatch):
+    # A year where pesex had a third answer
+    pesex_dict = CodeTable({**config.pesex_dict.codes, "3": "Another Gender"},
+                           qualitative=config.pesex_dict.qualitative)
+    monkeypatch.setattr(config, "year_overrides",
+                        {2021: {}, 2019: {"tables": {"pesex": pesex_dict},
+                                          "drop": ["hefaminc"]}})
+
+    dtypes, _ = schema.build_schema(multi_year.year_codebook(2019))
+    assert schema.build_schema(multi_year.year_codebook(2021))[0] == schema.cev_dtypes
+
+    assert "Another Gender" in dtypes["Gender"].categories
+    assert "Another Gender" not in schema.cev_dtypes["Gender"].categories
+    assert "Family_Income_Level" in schema.cev_dtypes
+    assert "Family_Income_Level" not in dtypes
@@ -0,0 +1,255 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import config
+import polarization
+
+
+states = ["IL", "CA", "TX", "NY", "WY"]
+
+
+def old_find_share_nation(df, democrat_label="Democrat"):
+    # find_share_nation from the notebook, loop for loop. The notebook compared the party
+    # to "Democratic"; democrat_label lets the tests run it both ways.
+    Party_People = ["Democrat", "Republican"]
+    Conservatives = ["Slightly Conservative",
+                     "Conservative",
+                     "Extremely Conservative"]
+    Liberals = ["Extremely Liberal",
+                "Liberal", "Slightly Liberal"]
+    Party_Count = []
+    Outlier_box = []
+    for index, entry in df.iterrows():
+        if entry["Party_Affiliation_(V201228)"] in Party_People:
+            Party_Count.append(1)
+        else:
+            Party_Count.append(0)
+    for index, entry in df.iterrows():
+        if (entry["Ideology_(V201200)"] in Conservatives) & (entry["Party_Affiliation_(V201228)"] == democrat_label):
+            Outlier_box.append(1)
+        elif (entry["Ideology_(V201200)"] in Liberals) & (entry["Party_Affiliation_(V201228)"] == "Republican"):
+            Outlier_box.append(1)
+        else:
+            Outlier_box.append(0)
+
+    df = df.copy()
+    df["Party_Count"] = Party_Count
+    df["Outliers"] = Outlier_box
+    return df
+
+
+def old_polar_table(df, democrat_label="Democrat"):
+    mod_df = old_find_share_nation(df, democrat_label)
+    mod_df = mod_df.groupby("US State 2")[
+        ["Outliers", "Party_Count"]
+        ].sum().reset_index()
+    mod_df["Percent_Outliers"] = mod_df["Outliers"] / sum(mod_df["Party_Count"])
+    return mod_df
+
+
+def old_seek_polar(df, state, democrat_label="Democrat"):
+    # find_share_state + seek_polar (find_share itself also had lower-case "conservative"
+    # labels, which find_share_state fixed)
+    mod_df = old_find_share_nation(df[df["US State 2"] == state], democrat_label)
+    mod_df = mod_df.groupby(
+        "Party_Affiliation_(V201228)"
+    )[["Outliers", "Party_Count"]].sum().reset_index()
+    mod_df["Percent_Outliers"] = mod_df["Outliers"] / \
+        sum(mod_df["Party_Count"])
+    return mod_df
+
+
+@pytest.fixture(scope="module")
+def raw_anes():
+    '''
+    Raw ANES codes for ideology and party, every code the crosswalks know (so the notebook's
+    inner merges don't drop anything), across a few states.
+    '''
+    rng = np.random.default_rng(0)
+    n_rows = 3000
+    return pd.DataFrame({
+        "V201200": rng.choice(list(config.anes_crosswalks["V201200"]["Ideology_(V201200)"]),
+                              n_rows),
+        "V201228": rng.choice(list(config.anes_crosswalks["V201228"][
+            "Party_Affiliation_(V201228)"]), n_rows),
+        "US State 2": rng.choice(states, n_rows),
+    })
+
+
+@pytest.fixture(scope="module")
+def merged(raw_anes):
+    # The notebook's crosswalk merges
+    crosswalk_polar = pd.DataFrame(
+        list(config.anes_crosswalks["V201200"]["Ideology_(V201200)"].items()),
+        columns=["Self_Rating_(V201200)", "Ideology_(V201200)"])
+    crosswalk_party_2 = pd.DataFrame(
+        list(config.anes_crosswalks["V201228"]["Party_Affiliation_(V201228)"].items()),
+        columns=["Party_Numbers_(V201228)", "Party_Affiliation_(V201228)"])
+    df = raw_anes.merge(crosswalk_polar, left_on="V201200", right_on="Self_Rating_(V201200)")
+    return df.merge(crosswalk_party_2, left_on="V201228", right_on="Party_Numbers_(V201228)")
+
+
+@pytest.fixture(scope="module")
+def crosswalked(raw_anes):
+    crosswalks = {question: config.anes_crosswalks[question] for question in ["V201200", "V201228"]}
+    df, unmapped = polarization.apply_crosswalks(raw_anes.copy(), crosswalks)
+    assert unmapped == {}
+    return df
+
+
+def test_crosswalks_match_merge(merged, crosswalked):
+    columns = ["US State 2", "Ideology_(V201200)", "Party_Affiliation_(V201228)"]
+    key = ["US State 2", "V201200", "V201228"]
+    expected = merged.sort_values(key, kind="stable").reset_index(drop=True)[columns]
+    result = crosswalked.sort_values(key, kind="stable").reset_index(drop=True)[columns]
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_polar_table_matches_notebook(merged, crosswalked):
+    expected = old_polar_table(merged)
+    result = polarization.polar_table(crosswalked)
+
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_polar_table_by_party_matches_seek_polar(merged, crosswalked):
+    by_party = polarization.polar_table_by_party(crosswalked)
+
+    for state in states:
+        expected = old_seek_polar(merged, state)
+        result = by_party[by_party["US State 2"] == state].drop(columns="US State 2")
+        pd.testing.assert_frame_equal(result.reset_index(drop=True), expected,
+                                      check_dtype=False)
+        pd.testing.assert_frame_equal(polarization.seek_polar(crosswalked, state)
+                                      .reset_index(drop=True), expected, check_dtype=False)
+
+
+def test_conservative_democrats_are_outliers(merged, crosswalked):
+    flagged = polarization.flag_partisans(crosswalked)
+    conservative_democrats = ((flagged["Party_Affiliation_(V201228)"] == "Democrat")
+                              & flagged["Ideology_(V201200)"].isin(polarization.conservatives))
+    assert conservative_democrats.any()
+    assert (flagged.loc[conservative_democrats, "Outliers"] == 1).all()
+
+    # The notebook's "Democratic" label never matched, so those rows weren't counted
+    notebook = old_polar_table(merged, democrat_label="Democratic")
+    fixed = polarization.polar_table(crosswalked)
+    missed = (crosswalked[conservative_democrats].groupby("US State 2").size()
+              .reindex(fixed["US State 2"]).to_numpy())
+    np.testing.assert_array_equal(fixed["Outliers"] - notebook["Outliers"], missed)
+
+
+def old_pivot_position(df):
+    # Steps 1-3 of the notebook's spread measure (filter the extremes, mean party positions
+    # by state and extreme group, pivot, spread)
+    ex_polarization = df[
+        (df["Ideology_(V201200)"] == "Extremely Conservative") |
+        (df["Ideology_(V201200)"] == "Extremely Liberal")
+        ]
+    ex_polarization = ex_polarization[
+        (df["Dem_Ideology_(V201206)"] != "Don't Know") &
+        (df["Dem_Ideology_(V201206)"] != "Refused") &
+        (df["Repub_Ideology_(V201207)"] != "Don't Know") &
+        (df["Repub_Ideology_(V201207)"] != "Refused")
+        ].copy()
+    ex_polarization["Extreme_Position"] = [
+        "Liberal" if row["Ideology_(V201200)"] == "Extremely Liberal" else "Conservative"
+        for index, row in ex_polarization.iterrows()
+        ]
+    position_groups = ex_polarization.groupby(["US State 2", "Extreme_Position"])[
+        ["Dem_Positioning(V201206)", "Repub_Positioning(V201207)"]].mean().reset_index()
+
+    pivot_position = position_groups.pivot(
+        index="US State 2",
+        columns="Extreme_Position",
+        values=["Dem_Positioning(V201206)", "Repub_Positioning(V201207)"]
+        ).reset_index()
+    pivot_position.columns = ['_'.join(col).strip() for col in pivot_position.columns.values]
+    pivot_position = pivot_position.rename(columns={
+        "US State 2_": "US State 2",
+        "Dem_Positioning(V201206)_Conservative": "Dem_Position_C",
+        "Dem_Positioning(V201206)_Liberal": "Dem_Position_L",
+        "Repub_Positioning(V201207)_Conservative": "Repub_Position_C",
+        "Repub_Positioning(V201207)_Liberal": "Repub_Position_L"
+    })
+    pivot_position["Spread_Dem"] = abs(
+        pivot_position["Dem_Position_C"] - pivot_position["Dem_Position_L"])
+    pivot_position["Spread_Repub"] = abs(
+        pivot_position["Repub_Position_C"] - pivot_position["Repub_Position_L"])
+    return pivot_position
+
+
+@pytest.fixture(scope="module")
+def positions():
+    '''
+    Crosswalked self-placement and party placement (V201206/V201207, including "Don't Know"
+    and "Refused"), with the extremes overrepresented so every state has both groups.
+    '''
+    rng = np.random.default_rng(1)
+    n_rows = 4000
+    placements = list(config.anes_crosswalks["V201206"]["Dem_Ideology_(V201206)"])
+    raw = pd.DataFrame({
+        "V201200": rng.choice([1, 7, 2, 4, 6, -9, 99], n_rows,
+                              p=[0.3, 0.3, 0.1, 0.1, 0.1, 0.05, 0.05]),
+        "V201206": rng.choice(placements, n_rows),
+        "V201207": rng.choice(placements, n_rows),
+        "US State 2": rng.choice(states, n_rows),
+    })
+    crosswalks = {question: config.anes_crosswalks[question]
+                  for question in ["V201200", "V201206", "V201207"]}
+    df, unmapped = polarization.apply_crosswalks(raw, crosswalks)
+    assert unmapped == {}
+    return df
+
+
+spread_columns = ["US State 2", "Dem_Position_C", "Dem_Position_L", "Repub_Position_C",
+                  "Repub_Position_L", "Spread_Dem", "Spread_Repub"]
+
+
+# The notebook filtered ex_polarization with masks built on the unfiltered frame
+@pytest.mark.filterwarnings("ignore:Boolean Series key will be reindexed")
+def test_spread_table_matches_notebook(positions):
+    expected = old_pivot_position(positions)
+    table = polarization.SpreadStats.from_frame(positions).table()
+
+    pd.testing.assert_frame_equal(table[spread_columns], expected[spread_columns],
+                                  check_dtype=False, check_names=False)
+    placed = ~positions[polarization.party_ideology_columns].isin(["Don't Know", "Refused"])
+    extremes = positions[placed.all(axis=1)]["Ideology_(V201200)"].value_counts()
+    assert table["N_L"].sum() == extremes["Extremely Liberal"]
+    assert table["N_C"].sum() == extremes["Extremely Conservative"]
+
+
+def test_spread_chunks_add_up(positions):
+    # The first chunk only has two of the states, so adding has to line the states up
+    first = positions[positions["US State 2"].isin(["IL", "CA"])]
+    rest = positions.drop(first.index)
+    chunks = [first, rest.iloc[:1000], rest.iloc[1000:]]
+
+    whole = polarization.SpreadStats.from_frame(positions).table()
+    added = sum((polarization.SpreadStats.from_frame(chunk) for chunk in chunks[1:]),
+                polarization.SpreadStats.from_frame(chunks[0]))
+    updated = polarization.SpreadStats()
+    for chunk in chunks:
+        updated.update(chunk)
+
+    pd.testing.assert_frame_equal(added.table(), whole)
+    pd.testing.assert_frame_equal(updated.table(), whole)
+
+
+def test_spread_bootstrap(positions):
+    stats = polarization.SpreadStats.from_frame(positions)
+    intervals = stats.bootstrap(n_boot=200, seed=0)
+
+    assert len(intervals) == len(states)
+    assert list(intervals.columns) == ["US State 2", "Spread_Dem", "Spread_Repub",
+                                       "Spread_Dem_Low", "Spread_Dem_High",
+                                       "Spread_Repub_Low", "Spread_Repub_High"]
+    for question in ["Dem", "Repub"]:
+        low, high = intervals[f"Spread_{question}_Low"], intervals[f"Spread_{question}_High"]
+        assert ((0 <= low) & (low <= high) & (high <= 6)).all()
+        # With this many respondents per state the interval is around the estimate
+        assert ((low <= intervals[f"Spread_{question}"])
+                & (intervals[f"Spread_{question}"] <= high)).all()
+    pd.testing.assert_frame_equal(stats.bootstrap(n_boot=200, seed=0), intervals)
@@ -0,0 +1,134 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+import config
+import data_store
+import multi_year
+from data_cache import write_cache, cache_path
+from decoder import CodeTableDecoder
+from features import add_derived_columns
+from query_backend import ArrowBackend, CubeBackend, PandasBackend, dashboard_query_columns
+from schema import apply_schema
+
+pytest.importorskip("pyarrow")
+
+
+def cleaned_frame(n_rows, seed):
+    '''
+    Synthetic cleaned CEV data (with the survey weights), the way the pipeline makes it.
+    '''
+    raw = benchmark.synthetic_cev(n_rows, seed=seed, weights=True)
+    selected = (raw[[c for c in dict.fromkeys(config.selected_variables) if c in raw.columns]]
+                .rename(columns=config.rename_mapping))
+    decoder = CodeTableDecoder.from_config({"gestfips": benchmark.fips_labels})
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", pd.errors.PerformanceWarning)
+        return add_derived_columns(config.add_engagement_score(
+            apply_schema(decoder.decode(selected)))).copy()
+
+
+@pytest.fixture(scope="module")
+def cleaned():
+    return cleaned_frame(3000, seed=1)
+
+
+@pytest.fixture(scope="module")
+def arrow_backend(cleaned, tmp_path_factory):
+    csv_path = tmp_path_factory.mktemp("cleaned") / "cleaned.csv"
+    csv_path.write_text("")
+    write_cache(cleaned, csv_path)
+    # Small batches, so the per-batch sums get combined
+    return ArrowBackend(cache_path(csv_path), batch_size=700)
+
+
+def assert_same(result, expected):
+    pd.testing.assert_frame_equal(result.reset_index(drop=True).astype({"category": object}),
+                                  expected.reset_index(drop=True).astype({"category": object}),
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize("metric_type", ["volunteer", "engagement"])
+@pytest.mark.parametrize("weighted", [False, True])
+def test_metric_matches_pandas(cleaned, arrow_backend, metric_type, weighted):
+    pandas_backend = PandasBackend(cleaned)
+    for column in config.variable_mapping:
+        assert_same(arrow_backend.metric(column, metric_type, weighted=weighted),
+                    pandas_backend.metric(column, metric_type, weighted=weighted))
+
+
+@pytest.mark.parametrize("metric_type", ["volunteer", "engagement"])
+def test_exclusion_stats_match_pandas(cleaned, arrow_backend, metric_type):
+    pandas_backend = PandasBackend(cleaned)
+    for column in config.variable_mapping:
+        assert (arrow_backend.exclusion_stats(column, metric_type)
+                == pandas_backend.exclusion_stats(column, metric_type))
+
+
+def test_shared_store_columns_answer_every_query(cleaned, tmp_path, monkeypatch):
+    csv_path = tmp_path / "cleaned.csv"
+    csv_path.write_text("")
+    monkeypatch.setattr(data_store, "load_cleaned_data",
+                        lambda path, columns=None, source_hash=None: cleaned)
+    shared = data_store.load_shared_data(csv_path, dashboard_query_columns())
+    assert len(shared.columns) < len(cleaned.columns)
+
+    shared_backend, pandas_backend = PandasBackend(shared), PandasBackend(cleaned)
+    for column in config.variable_mapping:
+        for metric_type in ["volunteer", "engagement"]:
+            assert (shared_backend.exclusion_stats(column, metric_type)
+                    == pandas_backend.exclusion_stats(column, metric_type))
+            for weighted in [False, True]:
+                assert_same(shared_backend.metric(column, metric_type, weighted=weighted),
+                            pandas_backend.metric(column, metric_type, weighted=weighted))
+
+
+@pytest.mark.parametrize("metric_type", ["volunteer", "engagement"])
+def test_pair_metric_matches_pandas(cleaned, arrow_backend, metric_type):
+    pandas_backend = PandasBackend(cleaned)
+    for row_column, column_column in [("Education_Level", "Urban_Rural_Status"),
+                                      ("Age", "Gender"), ("Household_Size", "US State")]:
+        pd.testing.assert_frame_equal(
+            arrow_backend.pair_metric(row_column, column_column, metric_type),
+            pandas_backend.pair_metric(row_column, column_column, metric_type),
+            check_dtype=False)
+
+
+def test_several_years_match_pandas(tmp_path):
+    frames = {2019: cleaned_frame(1500, seed=2), 2021: cleaned_frame(2000, seed=3)}
+    for year, df in frames.items():
+        multi_year.write_year(df, year, tmp_path)
+
+    backend = ArrowBackend(multi_year.parquet_root(tmp_path), batch_size=500)
+    for years in [[2019], [2019, 2021]]:
+        result = backend.for_years(years).metric("Education_Level", "volunteer", weighted=True)
+        expected = pd.concat(
+            [PandasBackend(frames[year]).metric("Education_Level", "volunteer", weighted=True)
+             .assign(Year=str(year)) for year in years], ignore_index=True)
+        if len(years) == 1:
+            expected = expected.drop(columns="Year")
+        assert_same(result, expected)
+
+        pairs = backend.for_years(years).pair_metric("Age", "Gender", "engagement")
+        assert np.isclose(pairs["count"].sum(), sum(
+            PandasBackend(frames[year]).pair_metric("Age", "Gender", "engagement")["count"].sum()
+            for year in years))
+
+
+@pytest.mark.parametrize("metric_type", ["volunteer", "engagement"])
+def test_several_years_exclusion_stats_match(tmp_path, metric_type):
+    frames = {2019: cleaned_frame(1500, seed=2), 2021: cleaned_frame(2000, seed=3)}
+    for year, df in frames.items():
+        multi_year.write_year(df, year, tmp_path)
+
+    years = [2019, 2021]
+    cube_backend = CubeBackend(multi_year.load_year_cubes(tmp_path, years))
+    arrow_backend = ArrowBackend(multi_year.parquet_root(tmp_path), batch_size=500).for_years(years)
+    pandas_backend = PandasBackend(pd.concat(frames.values(), ignore_index=True))
+    for column in config.variable_mapping:
+        expected = pandas_backend.exclusion_stats(column, metric_type)
+        assert cube_backend.exclusion_stats(column, metric_type) == expected
+        assert arrow_backend.exclusion_stats(column, metric_type) == expected